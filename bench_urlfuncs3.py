@@ -0,0 +1,846 @@
+# -*- coding: utf-8 -*-
+""" Urlfuncs3 Library Benchmark Module
+
+Run as script:
+    python bench_urlfuncs3.py                   # every public function
+    python bench_urlfuncs3.py --json out.json   # ... and save results
+    python bench_urlfuncs3.py --baseline base.json --threshold 0.2
+    python bench_urlfuncs3.py --features        # before/after comparisons
+"""
+
+import argparse
+import collections
+import inspect
+import json
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import time
+import timeit
+import urlfuncs3
+
+
+URLS = [
+    'http://www.google.com.ua/search?q=test',
+    'https://www.hello-world.co.uk/',
+    'http://привет.рф/item/1633-с-высоты/',
+    'ftp://www.sftp.org/pub/file.tar.gz',
+    'http://50.22.113.176/a/b/c/',
+]
+
+PAGE_URL = 'http://www.google.com.ua/'
+
+
+def chain_strings(urls):
+    """ Typical 5-call chain on plain strings """
+    for url in urls:
+        urlfuncs3.get_url_domain(url)
+        urlfuncs3.split_url(url)
+        urlfuncs3.is_url_domain(url)
+        urlfuncs3.get_domain_zone(url)
+        urlfuncs3.is_link_internal(url, PAGE_URL)
+
+
+def chain_parsed(urls):
+    """ The same 5-call chain on URL parsed once """
+    for url in urls:
+        url = urlfuncs3.ParsedURL(url)
+        urlfuncs3.get_url_domain(url)
+        urlfuncs3.split_url(url)
+        urlfuncs3.is_url_domain(url)
+        urlfuncs3.get_domain_zone(url)
+        urlfuncs3.is_link_internal(url, PAGE_URL)
+
+
+def per_url_usec(func, data, number=2000):
+    """ Best per-item time of func(data) in microseconds """
+    timer = timeit.Timer(lambda: func(data))
+    best = min(timer.repeat(repeat=5, number=number))
+    return best / number / len(data) * 1e6
+
+
+def run_async(generator):
+    """ List of items of async generator, collected in a new event loop """
+    import asyncio
+
+    async def collect():
+        return [item async for item in generator]
+    return asyncio.run(collect())
+
+
+def bench_parsed_url():
+    before = per_url_usec(chain_strings, URLS)
+    after = per_url_usec(chain_parsed, URLS)
+    print('5-call chain, str:       %8.2f us/url' % before)
+    print('5-call chain, ParsedURL: %8.2f us/url' % after)
+    print('speedup:                 %8.2fx' % (before / after))
+
+
+def validate_all(urls):
+    for url in urls:
+        urlfuncs3.is_string_url(url)
+        urlfuncs3.is_string_domain(url)
+
+
+def bench_cache():
+    urls = URLS * 20
+    before = per_url_usec(validate_all, urls, number=200)
+    urlfuncs3.enable_cache()
+    try:
+        after = per_url_usec(validate_all, urls, number=200)
+        stats = urlfuncs3.cache_stats()['is_string_url']
+    finally:
+        urlfuncs3.disable_cache()
+    print('validators, no cache:    %8.2f us/url' % before)
+    print('validators, LRU cache:   %8.2f us/url' % after)
+    print('cache hits/misses:       %d/%d' % (stats['hits'], stats['misses']))
+
+
+PATHOLOGICAL_URLS = [
+    'http://' + 'a.' * 30000 + '!',
+    'http://' + ('a' * 60 + '.') * 1000 + '!',
+    'http://' + 'ab.' * 30000 + '-',
+    'http://' + 'a-' * 30000 + '.',
+]
+
+
+def bench_url_syntax():
+    regex = urlfuncs3.DJANGO_URL_REGEX
+    for url in PATHOLOGICAL_URLS:
+        before = per_url_usec(
+            lambda urls: [regex.search(u) for u in urls], [url], number=5)
+        after = per_url_usec(
+            lambda urls: [urlfuncs3.is_url_syntax_valid(u) for u in urls],
+            [url], number=5)
+        print('%-24r regex %9.1f us, linear %8.1f us' % (
+            url[:24], before, after))
+
+
+def bench_validate_many(count=200000):
+    urls = (URLS * (count // len(URLS) + 1))[:count]
+    for workers in (1, 2, 4, 8):
+        started = time.perf_counter()
+        for _ in urlfuncs3.validate_many(urls, workers=workers):
+            pass
+        elapsed = time.perf_counter() - started
+        print('validate_many, %d workers: %10.0f urls/s' % (
+            workers, count / elapsed))
+
+
+def bench_public_suffix():
+    started = time.perf_counter()
+    psl = urlfuncs3.PublicSuffixList.from_file()
+    parsed = time.perf_counter() - started
+    psl.save('bench_psl.bin')
+    started = time.perf_counter()
+    loaded = urlfuncs3.PublicSuffixList.load('bench_psl.bin')
+    mapped = time.perf_counter() - started
+    lookup = per_url_usec(
+        lambda urls: [urlfuncs3.get_public_suffix(u, loaded) for u in urls],
+        URLS)
+    loaded.close()
+    os.remove('bench_psl.bin')
+    print('PSL parse text:          %8.2f ms' % (parsed * 1000))
+    print('PSL load compiled:       %8.2f ms' % (mapped * 1000))
+    print('get_public_suffix:       %8.2f us/url' % lookup)
+
+
+def bench_decode_string(size=2 * 1024 * 1024):
+    line = 'http://пример.рф/страница?запрос=поиск товаров\n'
+    data = (line * (size // len(line) + 1)).encode('koi8-r')[:size]
+    chardet = urlfuncs3._get_chardet()
+    started = time.perf_counter()
+    chardet.detect(data)
+    before = time.perf_counter() - started
+    started = time.perf_counter()
+    urlfuncs3.decode_string(data)
+    after = time.perf_counter() - started
+    print('detect %d MB, full:       %8.2f ms' % (size >> 20, before * 1000))
+    print('decode_string, sampled:  %8.2f ms' % (after * 1000))
+
+
+PAGE_LINKS = [
+    'http://www.google.com.ua/search?q=%d',
+    'https://www.google.com.ua/images/%d.png',
+    'http://example.com/page/%d',
+    '/relative/path/%d.html',
+    '../up/%d',
+    '#anchor%d',
+    '?page=%d',
+    'mailto:user%d@example.com',
+]
+
+
+def page_links(count=2000):
+    return [PAGE_LINKS[i % len(PAGE_LINKS)] % i for i in range(count)]
+
+
+def classify_links_one_by_one(links, page_url):
+    """ classify_links made of per-link library calls """
+    classified = []
+    for link in links:
+        if urlfuncs3.is_string_url(link.strip()):
+            internal = urlfuncs3.is_link_internal(link, page_url)
+            classified.append((internal, link))
+        else:
+            classified.append((None, urlfuncs3.make_absolute_url(
+                link, page_url)))
+    return classified
+
+
+def bench_classify_links():
+    links = page_links()
+    started = time.perf_counter()
+    classify_links_one_by_one(links, PAGE_URL)
+    before = time.perf_counter() - started
+    started = time.perf_counter()
+    urlfuncs3.classify_links(links, PAGE_URL)
+    after = time.perf_counter() - started
+    print('2000 links, per link:    %8.2f ms/page' % (before * 1000))
+    print('2000 links, batch:       %8.2f ms/page' % (after * 1000))
+
+
+def bench_make_absolute_urls():
+    links = page_links()
+    before = per_url_usec(
+        lambda urls: [urlfuncs3.make_absolute_url(u, PAGE_URL) for u in urls],
+        links, number=5)
+    after = per_url_usec(
+        lambda urls: urlfuncs3.make_absolute_urls(urls, PAGE_URL),
+        links, number=5)
+    print('make_absolute_url:       %8.2f us/link' % before)
+    print('make_absolute_urls:      %8.2f us/link' % after)
+
+
+def bench_domain_set(count=500000):
+    domains = ['site%d.example%d.com' % (i, i % 100) for i in range(count)]
+    started = time.perf_counter()
+    domain_set = urlfuncs3.DomainSet(domains)
+    built = time.perf_counter() - started
+    urls = ['http://www.site%d.example%d.com/page' % (i, i % 100)
+            for i in range(0, count, 50)] + URLS * 1000
+    lookup = per_url_usec(domain_set.matches_many, urls, number=1)
+    print('DomainSet of %d:    %8.2f s to build' % (count, built))
+    print('DomainSet.matches_many:  %8.2f us/url' % lookup)
+
+
+def bench_bloom_filter(count=200000):
+    urls = ['http://www.site%d.com/page%d/' % (i, i % 7)
+            for i in range(count)]
+    for error_rate in (0.01, 0.001):
+        bloom = urlfuncs3.BloomFilter(count, error_rate)
+        started = time.perf_counter()
+        bloom.add_many(urls)
+        added = time.perf_counter() - started
+        started = time.perf_counter()
+        bloom.contains_many(urls)
+        checked = time.perf_counter() - started
+        print('BloomFilter, error %-5s %8.2f bytes/url, %d add/s, '
+              '%d check/s' % (
+                  error_rate, len(bloom.bits) / float(count), count / added,
+            count / checked))
+    keys = set(urlfuncs3.canonical_url_key(url) for url in urls)
+    memory = sys.getsizeof(keys) + sum(sys.getsizeof(key) for key in keys)
+    print('set of canonical URLs:   %8.2f bytes/url' % (memory / len(keys)))
+
+
+def set_dedupe(urls):
+    seen = set()
+    for url in urls:
+        url_key = urlfuncs3.canonical_url_key(url)
+        if url_key not in seen:
+            seen.add(url_key)
+            yield url
+
+
+def bench_dedupe(count=200000):
+    urls = ['http://www.site%d.com/page/' % (i % (count // 4))
+            for i in range(count)]
+    elapsed = per_url_usec(lambda c: list(set_dedupe(c)), urls, number=1)
+    print('dedupe, plain set:       %8.2f us/url' % elapsed)
+    for label, options in (
+            ('exact', {}),
+            ('exact, spilled', {'max_items': count // 20}),
+            ('bloom', {'mode': urlfuncs3.DEDUP_BLOOM, 'capacity': count})):
+        dedup = urlfuncs3.URLDeduplicator(**options)
+        elapsed = per_url_usec(lambda c: list(dedup.dedupe(c)), urls,
+                               number=1)
+        print('dedupe, %-17s%8.2f us/url, peak %d KiB' % (
+            label + ':', elapsed, dedup.stats()['peak_memory'] // 1024))
+
+
+def bench_url_table(count=200000):
+    import urllib.parse
+    urls = ['https://www.site%d.com/category/%d/item?id=%d' % (
+        i % 5000, i % 37, i) for i in range(count)]
+    started = time.perf_counter()
+    table = urlfuncs3.URLTable(urls)
+    built = time.perf_counter() - started
+    parsed = [urllib.parse.urlparse(url) for url in urls]
+    naive = sum(sys.getsizeof(url) for url in urls) + sys.getsizeof(urls)
+    naive += sum(sys.getsizeof(result) + sum(map(sys.getsizeof, result))
+                 for result in parsed) + sys.getsizeof(parsed)
+    del parsed
+    print('URLTable:                %8.2f bytes/url, %.2f s to build' % (
+        table.memory_usage() / float(count), built))
+    print('str + urlparse:          %8.2f bytes/url' % (naive / float(count)))
+    zones = per_url_usec(lambda _: table.get_domain_zones(), urls, number=1)
+    print('URLTable.get_domain_zones: %6.2f us/url' % zones)
+    zones = per_url_usec(
+        lambda urls: [urlfuncs3.get_domain_zone(url) for url in urls],
+        urls, number=1)
+    print('get_domain_zone:         %8.2f us/url' % zones)
+
+
+def bench_bytes_lines(count=50000):
+    lines = [('http://www.site%d.com/page/%d?q=%d' % (i % 5000, i, i)).encode()
+             for i in range(count)]
+    for name in ('get_url_domain', 'is_string_domain', 'get_root_domain_zone'):
+        func = getattr(urlfuncs3, name)
+        as_str = per_url_usec(
+            lambda lines: [func(urlfuncs3.decode_url(line)) for line in lines],
+            lines, number=1)
+        as_bytes = per_url_usec(
+            lambda lines: [func(line) for line in lines], lines, number=1)
+        print('%-22s str %6.2f us/line, bytes %6.2f us/line' % (
+            name + ':', as_str, as_bytes))
+
+
+def bench_log_scan(count=200000):
+    import tempfile
+    referers = ['"-"', '"https://www.site%d.com/page?x=%d"',
+                '"http://пример.рф/"', '"HTTP://Other.org/a"']
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'access.log')
+        with open(path, 'w', encoding='utf-8') as log_file:
+            for i in range(count):
+                referer = referers[i % len(referers)]
+                if '%' in referer:
+                    referer = referer % (i % 500, i)
+                log_file.write(
+                    '10.0.%d.%d - - [10/Oct/2026:13:55:36 +0000] '
+                    '"GET /index%d.html HTTP/1.1" 200 2326 %s "Mozilla/5.0"\n'
+                    % (i % 256, i % 200, i, referer))
+        size = os.path.getsize(path) / 1e6
+
+        def readline_scan():
+            with open(path, 'rb') as log_file:
+                for line in log_file:
+                    for field in line.split(b'"'):
+                        urlfuncs3.is_string_url(field)
+
+        for label, scan in (
+                ('readline + is_string_url', readline_scan),
+                ('iter_log_urls', lambda: list(
+                    urlfuncs3.iter_log_urls(path))),
+                ('iter_log_urls, no check', lambda: list(
+                    urlfuncs3.iter_log_urls(path, validate=False))),
+                ('iter_log_domains', lambda: list(
+                    urlfuncs3.iter_log_domains(path)))):
+            started = time.perf_counter()
+            scan()
+            elapsed = time.perf_counter() - started
+            print('%-25s %8.2f MB/s' % (label + ':', size / elapsed))
+
+
+def bench_find_urls(words=600000):
+    random.seed(3)
+    vocabulary = ('lorem ipsum dolor sit amet, consectetur adipiscing elit '
+                  'sed do eiusmod tempor').split()
+    parts = []
+    for i in range(words):
+        chance = random.random()
+        if chance < 0.01:
+            parts.append('https://www.site%d.com/p?q=%d.' % (i % 300, i))
+        elif chance < 0.015:
+            parts.append('(www.example%d.org/x)' % (i % 50))
+        else:
+            parts.append(random.choice(vocabulary))
+    text = ' '.join(parts)
+    naive = re.compile(r'(?i)\b(?:(?:https?|ftps?)://|www\.)[^\s<>"]+')
+    for label, find in (
+            ('regex, no validation', lambda: naive.findall(text)),
+            ('find_urls', lambda: urlfuncs3.find_urls(text))):
+        elapsed = min(timeit.repeat(find, number=1, repeat=3))
+        print('%-25s %8.2f MB/s' % (label + ':', len(text) / 1e6 / elapsed))
+
+
+def bench_host_analytics(count=500000):
+    urls = ['https://www.site%d.co.uk/category/%d/item?id=%d' % (
+        i % 10000, i % 37, i) for i in range(count)]
+    per_row = per_url_usec(
+        lambda urls: collections.Counter(
+            urlfuncs3.get_domain_zone(url) for url in urls), urls, number=1)
+    print('get_domain_zone counts:  %8.2f us/url' % per_row)
+    columns = [('list', urls)]
+    numpy = urlfuncs3._get_numpy()
+    if numpy is not None:
+        columns.append(('NumPy array', numpy.array(urls)))
+    for label, column in columns:
+        elapsed = per_url_usec(
+            lambda column: urlfuncs3.HostAnalytics(column).counts('zone'),
+            column, number=1)
+        print('HostAnalytics, %-11s%8.2f us/url' % (label + ':', elapsed))
+
+
+def chained_clean(url):
+    """ full_clean_url as a chain of separate passes """
+    url = url.strip()
+    url = urlfuncs3.remove_http(url)
+    url = urlfuncs3.remove_last_slash(url)
+    return urlfuncs3.remove_www(url)
+
+
+def bench_normalize(count=200000):
+    urls = ['  https://www.site%d.com/path/%d/  ' % (i % 1000, i)
+            for i in range(count)]
+    before = per_url_usec(
+        lambda urls: [chained_clean(url) for url in urls], urls, number=1)
+    after = per_url_usec(urlfuncs3.normalize_many, urls, number=1)
+    print('full_clean_url chain:    %8.2f us/url' % before)
+    print('normalize_many:          %8.2f us/url  (%.1fx)' % (
+        after, before / after))
+    normalizer = urlfuncs3.URLNormalizer(urlfuncs3.NORMALIZE_STEPS)
+    every_step = per_url_usec(normalizer.normalize_many, urls, number=1)
+    print('normalize_many, all steps:%7.2f us/url' % every_step)
+
+
+def bench_split_urls(count=200000):
+    urls = ['https://www.site%d.com/category/%d/item?id=%d' % (
+        i % 1000, i % 37, i) for i in range(count)]
+    before = per_url_usec(
+        lambda urls: [urlfuncs3.split_url(url) for url in urls], urls,
+        number=1)
+    after = per_url_usec(urlfuncs3.split_urls, urls, number=1)
+    print('split_url one by one:    %8.2f us/url' % before)
+    print('split_urls:              %8.2f us/url  (%.1fx)' % (
+        after, before / after))
+
+
+def toggled_variants(url):
+    """ 8 http/https x www x slash variants built with toggle functions """
+    if url.startswith('https://'):
+        other = 'http://' + url[8:]
+    else:
+        other = 'https://' + url[7:]
+    variants = []
+    for url in (url, other):
+        for url in (url, urlfuncs3.toggle_url_www(url)):
+            variants.append(url)
+            variants.append(urlfuncs3.toggle_last_url_slash(url))
+    return variants
+
+
+def toggle_join(customer, crawl):
+    customer = set(customer)
+    return [[variant for variant in toggled_variants(url)
+             if variant in customer] for url in crawl]
+
+
+def bench_url_index(count=50000):
+    customer = ['https://www.site%d.com/page/%d/' % (i % 1000, i)
+                for i in range(count)]
+    crawl = ['http://site%d.com/page/%d' % (i % 1000, i)
+             for i in range(0, count * 2, 2)]
+    before = per_url_usec(lambda crawl: toggle_join(customer, crawl), crawl,
+                          number=1)
+    after = per_url_usec(
+        lambda crawl: urlfuncs3.URLIndex(customer).lookup_many(crawl),
+        crawl, number=1)
+    print('8 toggled variants join: %8.2f us/url' % before)
+    print('URLIndex join:           %8.2f us/url  (%.1fx)' % (
+        after, before / after))
+
+
+def bench_instrumentation():
+    def check(urls):
+        for url in urls:
+            urlfuncs3.is_string_url(url)
+            urlfuncs3.get_url_domain(url)
+    off = per_url_usec(check, URLS)
+    urlfuncs3.enable_instrumentation()
+    try:
+        on = per_url_usec(check, URLS)
+    finally:
+        urlfuncs3.disable_instrumentation()
+    print('2 calls, instrumentation off: %6.2f us/url' % off)
+    print('2 calls, instrumentation on:  %6.2f us/url' % on)
+
+
+async def loop_latency(work, interval=0.001):
+    """ Max and 99th percentile lateness of a ticker in ms while work runs """
+    import asyncio
+    lateness = []
+    done = asyncio.Event()
+
+    async def ticker():
+        loop = asyncio.get_running_loop()
+        while not done.is_set():
+            started = loop.time()
+            await asyncio.sleep(interval)
+            lateness.append(loop.time() - started - interval)
+
+    task = asyncio.ensure_future(ticker())
+    await asyncio.sleep(interval)
+    await work()
+    done.set()
+    await task
+    lateness.sort()
+    return (lateness[-1] * 1000,
+            lateness[int(len(lateness) * 0.99) - 1] * 1000)
+
+
+def bench_async(count=100000):
+    import asyncio
+    import concurrent.futures
+    lines = ['http://www.site%d.com/page\n' % i for i in range(count)]
+
+    async def stream():
+        for line in lines:
+            yield line
+
+    async def blocking():
+        await asyncio.sleep(0)
+        for _ in urlfuncs3.iter_url_list(lines):
+            pass
+
+    async def streamed(executor=None):
+        async for _ in urlfuncs3.aiter_url_list(stream(), executor=executor):
+            pass
+
+    async def processes():
+        with concurrent.futures.ProcessPoolExecutor(2) as executor:
+            await streamed(executor)
+
+    for label, work in (('iter_url_list', blocking),
+                        ('aiter_url_list, threads', streamed),
+                        ('aiter_url_list, procs', processes)):
+        started = time.perf_counter()
+        worst, p99 = asyncio.run(loop_latency(work))
+        elapsed = time.perf_counter() - started
+        print('loop lag, %-24s max %7.2f ms, p99 %6.2f ms, %5.2f s' % (
+            label + ':', worst, p99, elapsed))
+
+
+def import_time_usec(module='urlfuncs3'):
+    """ Cumulative import time of module in a fresh interpreter,
+    as reported by python -X importtime
+    """
+    output = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import %s' % module],
+        stderr=subprocess.PIPE, universal_newlines=True,
+        cwd=os.path.dirname(os.path.abspath(__file__))).stderr
+    for line in output.splitlines():
+        parts = line.split('|')
+        if len(parts) == 3 and parts[2].strip() == module:
+            return int(parts[1])
+    raise RuntimeError('No import time of %s in output' % module)
+
+
+def bench_import_time():
+    best = min(import_time_usec() for _ in range(5))
+    print('import urlfuncs3:        %8.2f ms' % (best / 1000.0))
+
+
+# Corpora of the per-function suite
+CORPORA = {
+    'ascii_urls': [
+        'http://www.google.com.ua/search?q=test',
+        'https://www.hello-world.co.uk/',
+        'ftp://www.sftp.org/pub/file.tar.gz',
+        'http://example.com:8080/a/b/c.html?x=1&y=2#top',
+        'https://sub.domain.example.org/path/to/page/',
+        'http://localhost/',
+    ],
+    'idn_urls': [
+        'http://привет.рф/item/1633-с-высоты/',
+        'https://www.стенгазета.рф/',
+        'http://алло.укр/алло-тест',
+        'http://xn--b1agh1afp.xn--p1ai/hello',
+    ],
+    'domains': [
+        'google.com', 'www.en.hello.world.co.uk', 'привет.рф',
+        'a-b-c.museum', 'example.com.au', 'city.kawasaki.jp',
+    ],
+    'ips': [
+        '127.0.0.1', '255.0.12.123', 'http://50.22.113.176/a/b/c/',
+        'http://10.0.0.1:8080/',
+    ],
+    'junk': [
+        '', ' ', 'word', 'not a url at all', 'i.ua/', 'chrome://hello.com/',
+        'http://a. a.a/', '__asd.com', 'a.a.a.a.a.a.a.a.a.a.a.aa..a',
+    ],
+    'pathological': [
+        'http://' + 'a.' * 1000 + '!',
+        'http://' + ('a' * 60 + '.') * 50 + '!',
+        'http://' + 'ab.' * 1000 + '-',
+        'http://' + 'a-' * 1000 + '.',
+    ],
+}
+
+BASE_URL = 'http://www.example.com/section/page.html'
+
+DOMAIN_SET = urlfuncs3.DomainSet(CORPORA['domains'])
+BLOOM_FILTER = urlfuncs3.BloomFilter(100000)
+
+# Public names which are not worth timing, with reason
+SUITE_SKIPPED = {
+    'LRUCache': 'covered by enable_cache suite entries',
+    'PublicSuffixList': 'covered by get_public_suffix',
+    'enable_cache': 'configuration',
+    'disable_cache': 'configuration',
+    'clear_cache': 'configuration',
+    'cache_stats': 'configuration',
+    'set_public_suffix_list': 'configuration',
+    'Instrumentation': 'measured by bench_instrumentation',
+    'enable_instrumentation': 'configuration',
+    'disable_instrumentation': 'configuration',
+    'instrumentation_stats': 'configuration',
+    'instrumentation_prometheus': 'configuration',
+    'iter_log_urls': 'reads files, measured by bench_log_scan',
+    'iter_log_domains': 'reads files, measured by bench_log_scan',
+    'split_log_file': 'reads files, measured by bench_log_scan',
+}
+
+
+def _lines(corpus):
+    return '\n'.join(corpus)
+
+
+# Suite entries: name -> callable(item) or ('batch', callable(corpus))
+SUITE = {
+    'decode_string': lambda s: urlfuncs3.decode_string(s.encode('utf-8')),
+    'detect_encoding': lambda s: urlfuncs3.detect_encoding(s.encode('cp1251')),
+    'decode_url': urlfuncs3.decode_url,
+    'ParsedURL': lambda s: urlfuncs3.ParsedURL(s).is_valid,
+    'parse_url': lambda s: urlfuncs3.parse_url(s).netloc,
+    'is_url_or_domain_valid': urlfuncs3.is_url_or_domain_valid,
+    'urlencode_string': urlfuncs3.urlencode_string,
+    'remove_http': urlfuncs3.remove_http,
+    'remove_last_slash': urlfuncs3.remove_last_slash,
+    'remove_www': urlfuncs3.remove_www,
+    'full_clean_url': urlfuncs3.full_clean_url,
+    'clear_http_and_last_slash': urlfuncs3.clear_http_and_last_slash,
+    'URLNormalizer': urlfuncs3.URLNormalizer(
+        urlfuncs3.NORMALIZE_STEPS).normalize,
+    'normalize_many': ('batch', urlfuncs3.normalize_many),
+    'is_link_internal': lambda s: urlfuncs3.is_link_internal(s, BASE_URL),
+    'get_url_domain': urlfuncs3.get_url_domain,
+    'make_absolute_url': lambda s: urlfuncs3.make_absolute_url('../a', s),
+    'is_url_domain': urlfuncs3.is_url_domain,
+    'split_url': urlfuncs3.split_url,
+    'split_urls': ('batch', lambda c: urlfuncs3.split_urls(
+        c, invalid=None)),
+    'is_string_ipv4': urlfuncs3.is_string_ipv4,
+    'is_string_domain': urlfuncs3.is_string_domain,
+    'is_url_syntax_valid': urlfuncs3.is_url_syntax_valid,
+    'is_string_url': urlfuncs3.is_string_url,
+    'toggle_last_url_slash': urlfuncs3.toggle_last_url_slash,
+    'toggle_url_www': urlfuncs3.toggle_url_www,
+    'get_root_domain_zone': urlfuncs3.get_root_domain_zone,
+    'get_domain_zone': urlfuncs3.get_domain_zone,
+    'get_public_suffix': urlfuncs3.get_public_suffix,
+    'get_registrable_domain': urlfuncs3.get_registrable_domain,
+    'parse_url_list': ('batch', lambda c: urlfuncs3.parse_url_list(_lines(c))),
+    'parse_domain_list': (
+        'batch', lambda c: urlfuncs3.parse_domain_list(_lines(c))),
+    'iter_url_list': ('batch', lambda c: list(
+        urlfuncs3.iter_url_list(c, on_error=lambda *args: None))),
+    'iter_domain_list': ('batch', lambda c: list(
+        urlfuncs3.iter_domain_list(c, on_error=lambda *args: None))),
+    'validate_many': (
+        'batch', lambda c: list(urlfuncs3.validate_many(c, workers=1))),
+    'clean_many': (
+        'batch', lambda c: list(urlfuncs3.clean_many(c, workers=1))),
+    'make_absolute_urls': (
+        'batch', lambda c: urlfuncs3.make_absolute_urls(c, BASE_URL)),
+    'URLResolver': lambda s: urlfuncs3.URLResolver(BASE_URL).resolve(s),
+    'DomainSet': DOMAIN_SET.matches,
+    'classify_links': (
+        'batch', lambda c: urlfuncs3.classify_links(c, BASE_URL)),
+    'canonical_url_key': urlfuncs3.canonical_url_key,
+    'url_variants': urlfuncs3.url_variants,
+    'URLIndex': ('batch', lambda c: urlfuncs3.URLIndex(c).lookup_many(c)),
+    'dedupe_urls': ('batch', lambda c: list(urlfuncs3.dedupe_urls(c))),
+    'URLDeduplicator': (
+        'batch', lambda c: list(urlfuncs3.URLDeduplicator().dedupe(c))),
+    'BloomFilter': lambda s: s in BLOOM_FILTER,
+    'aiter_url_list': ('batch', lambda c: run_async(
+        urlfuncs3.aiter_url_list(c, on_error=lambda *args: None))),
+    'avalidate_many': ('batch', lambda c: run_async(
+        urlfuncs3.avalidate_many(c))),
+    'aclean_many': ('batch', lambda c: run_async(urlfuncs3.aclean_many(c))),
+    'find_urls': lambda s: urlfuncs3.find_urls('See %s, or not.' % s),
+    'iter_urls': lambda s: list(urlfuncs3.iter_urls(s)),
+    'classify_host': urlfuncs3.classify_host,
+    'HostAnalytics': (
+        'batch', lambda c: urlfuncs3.HostAnalytics(c).counts('zone')),
+    'URLTable': ('batch', lambda c: urlfuncs3.URLTable(
+        url for url in c if urlfuncs3.is_string_url(url)).get_domain_zones()),
+}
+
+
+def uncovered_functions():
+    """ Public functions and classes of urlfuncs3 missing in SUITE """
+    names = []
+    for name, value in vars(urlfuncs3).items():
+        if name.startswith('_') or name in SUITE or name in SUITE_SKIPPED:
+            continue
+        if inspect.isfunction(value) or inspect.isclass(value):
+            if value.__module__ == urlfuncs3.__name__:
+                names.append(name)
+    return names
+
+
+def percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * fraction))
+    return sorted_values[index]
+
+
+def time_calls(func, args, min_seconds):
+    """ Time every func(arg) call separately for at least min_seconds
+
+    :returns: dict with ops per second and p50/p99 call time in us
+    """
+    timings = []
+    clock = time.perf_counter_ns
+    deadline = time.perf_counter() + min_seconds
+    while True:
+        for arg in args:
+            started = clock()
+            try:
+                func(arg)
+            except ValueError:
+                pass
+            timings.append(clock() - started)
+        if time.perf_counter() >= deadline:
+            break
+    timings.sort()
+    return {
+        'ops': round(len(timings) * 1e9 / sum(timings), 1),
+        'p50_us': round(percentile(timings, 0.5) / 1000.0, 3),
+        'p99_us': round(percentile(timings, 0.99) / 1000.0, 3),
+        'calls': len(timings),
+    }
+
+
+def run_suite(only=None, min_seconds=0.05):
+    """ Time SUITE entries on every corpus
+
+    :param only: Names of functions to time, all by default
+    :param min_seconds: Min time spent on each function and corpus
+    :returns: dict of results by "function/corpus" key
+    """
+    # Warm up lazy state: regexes, Public Suffix List, NumPy import
+    urlfuncs3.get_public_suffix('example.com')
+    urlfuncs3.is_string_domain('example.com')
+    urlfuncs3._get_numpy()
+    results = {}
+    for name in sorted(SUITE):
+        if only and name not in only:
+            continue
+        entry = SUITE[name]
+        for corpus_name, corpus in sorted(CORPORA.items()):
+            if isinstance(entry, tuple):
+                result = time_calls(entry[1], [corpus], min_seconds)
+            else:
+                result = time_calls(entry, corpus, min_seconds)
+            results['%s/%s' % (name, corpus_name)] = result
+    return results
+
+
+def compare(results, baseline, threshold):
+    """ Keys of results slower than baseline by more than threshold
+
+    :param threshold: Allowed relative drop of ops per second, 0.2 = 20%
+    :returns: list of (key, baseline ops, current ops)
+    """
+    regressions = []
+    for key, result in sorted(results.items()):
+        base = baseline.get(key)
+        if base and result['ops'] < base['ops'] * (1.0 - threshold):
+            regressions.append((key, base['ops'], result['ops']))
+    return regressions
+
+
+def print_results(results):
+    print('%-42s %14s %10s %10s' % ('function/corpus', 'ops/s', 'p50 us',
+                                    'p99 us'))
+    for key, result in sorted(results.items()):
+        print('%-42s %14.1f %10.3f %10.3f' % (
+            key, result['ops'], result['p50_us'], result['p99_us']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='urlfuncs3 benchmarks')
+    parser.add_argument('--features', action='store_true',
+                        help='run before/after feature comparisons')
+    parser.add_argument('--only', nargs='+', metavar='FUNCTION',
+                        help='time only these functions')
+    parser.add_argument('--min-seconds', type=float, default=0.05,
+                        help='min time per function and corpus')
+    parser.add_argument('--json', metavar='PATH', help='save results')
+    parser.add_argument('--baseline', metavar='PATH',
+                        help='compare with results saved by --json')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='allowed ops/s drop against baseline')
+    args = parser.parse_args(argv)
+
+    if args.features:
+        run_features()
+        return 0
+
+    for name in uncovered_functions():
+        print('WARNING: %s is not in benchmark suite' % name)
+    results = run_suite(args.only, args.min_seconds)
+    print_results(results)
+
+    if args.json:
+        with open(args.json, 'w') as json_file:
+            json.dump({
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'results': results,
+            }, json_file, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as json_file:
+            baseline = json.load(json_file)['results']
+        regressions = compare(results, baseline, args.threshold)
+        for key, before, after in regressions:
+            print('REGRESSION %s: %.1f -> %.1f ops/s' % (key, before, after))
+        if regressions:
+            return 1
+    return 0
+
+
+def run_features():
+    bench_parsed_url()
+    bench_cache()
+    bench_url_syntax()
+    bench_validate_many()
+    bench_public_suffix()
+    bench_decode_string()
+    bench_classify_links()
+    bench_make_absolute_urls()
+    bench_domain_set()
+    bench_dedupe()
+    bench_bloom_filter()
+    bench_async()
+    bench_instrumentation()
+    bench_url_table()
+    bench_bytes_lines()
+    bench_log_scan()
+    bench_find_urls()
+    bench_host_analytics()
+    bench_normalize()
+    bench_split_urls()
+    bench_url_index()
+    bench_import_time()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,8 +4,19 @@
 :author: Anton Gorunov
 """
 
+import asyncio
+import concurrent.futures
+import gc
+import io
+import os
+import random
+import subprocess
+import sys
+import tempfile
 import unittest
+import urllib.parse
 import urlfuncs3
+import weakref
 
 
 class TestUrlfuncs(unittest.TestCase):
@@ -130,6 +141,9 @@ class TestUrlfuncs(unittest.TestCase):
         self.assertEqual(
             f('ftp://www.стенгазета.рф/test/'),
             ('стенгазета.рф', '/test/'))
+        self.assertEqual(
+            f('http://www.a.com/mirror/a.com/page'),
+            ('a.com', '/mirror/a.com/page'))
 
         # Raises all invalid urls from `test_is_string_url` method
         with self.assertRaises(ValueError):
@@ -177,6 +191,28 @@ class TestUrlfuncs(unittest.TestCase):
         with self.assertRaises(ValueError):
             f('test.html', 'http://test .com/test/test')
 
+    def test_make_absolute_urls(self):
+        f = urlfuncs3.make_absolute_urls
+        base = 'http://d.com/a/b;p?q=1#f'
+        relatives = ['', '#', '#top', '?', '?x=2#y', '../c', '/d', 'e?f',
+                     'https://e.com/x?', 'http://E.com/y?#', '//cdn.com/z',
+                     'mailto:me@d.com', ' #spaced', 'a\tb']
+        self.assertEqual(f(relatives, base),
+            [urlfuncs3.make_absolute_url(r, base) for r in relatives])
+        self.assertEqual(f(['#top', '?x=2', 'mailto:a@b.c'], base), [
+            'http://d.com/a/b;p?q=1#top', 'http://d.com/a/b;p?x=2',
+            'mailto:a@b.c'])
+        with self.assertRaises(ValueError):
+            f(['test.html'], 'i.ua/')
+
+    def test_url_resolver(self):
+        resolver = urlfuncs3.URLResolver('http://d.com/a/b/c')
+        self.assertEqual(resolver.resolve('../b'), 'http://d.com/a/b')
+        self.assertEqual(resolver.resolve_many(['#x', 'http://e.com']),
+                         ['http://d.com/a/b/c#x', 'http://e.com'])
+        with self.assertRaises(ValueError):
+            urlfuncs3.URLResolver('http://test .com/test/test')
+
     def test_get_url_domain(self):
         f = urlfuncs3.get_url_domain
         self.assertEqual(f('http://test.com'), 'test.com')
@@ -206,6 +242,31 @@ class TestUrlfuncs(unittest.TestCase):
         # External
         self.assertFalse(f('http://i.ua', 'http://ya.ru/section/'))
 
+    def test_classify_links(self):
+        f = urlfuncs3.classify_links
+        links = [' https://www.ya.ru/page ', 'http://i.ua', '../other?q=1',
+                 '#top', '//ya.ru/cdn.js', '//i.ua/x', 'mailto:me@ya.ru',
+                 'chrome://settings/', 'http://[x/', '//[::1']
+        self.assertEqual(f(links, 'http://ya.ru/section/page'), [
+            ('internal', 'https://www.ya.ru/page'),
+            ('external', 'http://i.ua'),
+            ('relative', 'http://ya.ru/other?q=1'),
+            ('relative', 'http://ya.ru/section/page#top'),
+            ('internal', 'http://ya.ru/cdn.js'),
+            ('external', 'http://i.ua/x'),
+            ('invalid', 'mailto:me@ya.ru'),
+            ('invalid', 'chrome://settings/'),
+            ('invalid', 'http://[x/'),
+            ('invalid', '//[::1'),
+        ])
+        # Absolute links are classified as is_link_internal does
+        for kind, url in f(links, 'http://ya.ru/section/page'):
+            if kind in (urlfuncs3.LINK_INTERNAL, urlfuncs3.LINK_EXTERNAL):
+                self.assertEqual(kind == 'internal', urlfuncs3.is_link_internal(
+                    url, 'http://ya.ru/section/page'))
+        with self.assertRaises(ValueError):
+            f(links, 'ya.ru/section/')
+
     def test_clear_http_and_last_slash(self):
         f = urlfuncs3.clear_http_and_last_slash
         self.assertEqual(f('  https://www.test.eu'), '  www.test.eu')
@@ -226,6 +287,7 @@ class TestUrlfuncs(unittest.TestCase):
         self.assertEqual(f('http://www.ya.ru/test'), 'http://ya.ru/test')
         self.assertEqual(f('www.привет.рф'), 'привет.рф')
         self.assertEqual(f('www.test.www.hello.com'), 'test.www.hello.com')
+        self.assertEqual(f('https://www.ya.ru'), 'https://ya.ru')
 
     def test_remove_last_slash(self):
         f = urlfuncs3.remove_last_slash
@@ -280,6 +342,20 @@ class TestUrlfuncs(unittest.TestCase):
         self.assertEqual(f("test".encode('cp1251')), "test")
         self.assertEqual(f("кои8р".encode('koi8-r')), "кои8р")
 
+    def test_decode_string_source(self):
+        f = urlfuncs3.decode_string
+        text = "привет, мир, как дела".encode('koi8-r')
+        self.assertEqual(f(text, source='list.txt'), "привет, мир, как дела")
+        self.assertEqual(urlfuncs3._SOURCE_ENCODINGS.get('list.txt'), 'KOI8-R')
+        # Next chunks of the source are decoded without detection
+        self.assertEqual(f("кои8р".encode('koi8-r'), source='list.txt'), "кои8р")
+
+    def test_detect_encoding(self):
+        f = urlfuncs3.detect_encoding
+        data = "привет, мир, как дела. ".encode('koi8-r') * 10000
+        self.assertEqual(f(data, sample_size=4096), 'KOI8-R')
+        self.assertEqual(f(data), 'KOI8-R')
+
     def test_parse_url_list(self):
         f = urlfuncs3.parse_url_list
         urls_text = ' http://test.com/some-page/ \n\n https://test2.com?q=     \r\n'
@@ -295,7 +371,762 @@ class TestUrlfuncs(unittest.TestCase):
         domains_text = ' http://test.com \n\n www.test2.com/test/?q=\r\n'
         domains_list = ['test.com', 'www.test2.com']
         self.assertEqual(f(domains_text), domains_list)
-        
+
+    def test_parsed_url(self):
+        f = urlfuncs3.ParsedURL
+        url = f('https://www.test.com:8080/hello?t=5')
+        self.assertTrue(url.is_valid)
+        self.assertEqual(url.netloc, 'www.test.com:8080')
+        self.assertEqual(url.host, 'www.test.com')
+        self.assertEqual(url.port, 8080)
+        self.assertEqual(url.path, '/hello')
+        self.assertEqual(url.query, 't=5')
+        self.assertEqual(f('http://привет.рф/').decoded,
+            'http://xn--b1agh1afp.xn--p1ai/')
+        self.assertEqual(f('http://www.google.co.uk/').zone, 'co.uk')
+        self.assertFalse(f('i.ua/').is_valid)
+
+        # Every function accepts ParsedURL as well as string
+        url = f('https://www.test.com/hello?t=5')
+        self.assertEqual(urlfuncs3.get_url_domain(url), 'www.test.com')
+        self.assertEqual(urlfuncs3.split_url(url), ('test.com', '/hello?t=5'))
+        self.assertFalse(urlfuncs3.is_url_domain(url))
+        self.assertEqual(urlfuncs3.get_domain_zone(url), 'com')
+        self.assertEqual(urlfuncs3.get_root_domain_zone(url), 'com')
+        self.assertEqual(urlfuncs3.toggle_url_www(url),
+            'https://test.com/hello?t=5')
+        self.assertEqual(urlfuncs3.full_clean_url(url), 'test.com/hello?t=5')
+        self.assertTrue(urlfuncs3.is_link_internal(url, f('http://test.com')))
+        self.assertIs(urlfuncs3.parse_url(url), url)
+        self.assertEqual(urlfuncs3.urlencode_string(f('http://ya.ru/?a=б')),
+                         'http%3A%2F%2Fya.ru%2F%3Fa%3D%D0%B1')
+        self.assertEqual(urlfuncs3.decode_string(url), url.url)
+        self.assertTrue(urlfuncs3.is_url_syntax_valid(url))
+        self.assertEqual(
+            urlfuncs3.decode_string(f('http://привет.рф/'.encode('utf-8'))),
+            'http://привет.рф/')
+        with self.assertRaises(ValueError):
+            urlfuncs3.get_url_domain(f('i.ua/'))
+
+    def test_cache(self):
+        urlfuncs3.enable_cache(maxsize=2, negative_maxsize=1)
+        try:
+            f = urlfuncs3.is_string_url
+            self.assertTrue(f('http://a.com'))
+            self.assertTrue(f('http://a.com'))
+            self.assertFalse(f('junk'))
+            self.assertFalse(f('junk2'))
+            self.assertTrue(f('http://b.com'))
+            self.assertTrue(f('http://c.com'))
+            stats = urlfuncs3.cache_stats()['is_string_url']
+            self.assertEqual(stats['hits'], 1)
+            self.assertEqual(stats['misses'], 5)
+            # One negative and one positive entry were evicted
+            self.assertEqual(stats['evictions'], 2)
+            self.assertEqual(stats['positive'], 2)
+            self.assertEqual(stats['negative'], 1)
+
+            self.assertTrue(urlfuncs3.is_string_domain('a.com'))
+            self.assertEqual(urlfuncs3.get_domain_zone('a.co.uk'), 'co.uk')
+            self.assertEqual(urlfuncs3.decode_url('http://привет.рф/'),
+                'http://xn--b1agh1afp.xn--p1ai/')
+
+            urlfuncs3.clear_cache()
+            stats = urlfuncs3.cache_stats()['is_string_url']
+            self.assertEqual(stats['hits'] + stats['positive'], 0)
+            with self.assertRaises(ValueError):
+                urlfuncs3.enable_cache(functions=('remove_www',))
+        finally:
+            urlfuncs3.disable_cache()
+        self.assertEqual(urlfuncs3.cache_stats(), {})
+
+    def test_is_url_syntax_valid(self):
+        f = urlfuncs3.is_url_syntax_valid
+        self.assertTrue(f('http://xn--b1agh1afp.xn--p1ai/'))
+        self.assertTrue(f('HTTPS://localhost:8080/?q=1'))
+        self.assertTrue(f('ftp://1.2.3.4'))
+        self.assertFalse(f('hello.com'))
+        self.assertFalse(f('http://' + 'ab.' * 5000 + '-'))
+        self.assertTrue(f('http://ya.ru/', max_length=13))
+        self.assertFalse(f('http://ya.ru/', max_length=12))
+
+        # Same results as DJANGO_URL_REGEX on random corpus
+        rnd = random.Random(1)
+        prefixes = ['http://', 'HTTPS://', 'ftps://', 'httpſ://', 'ftp:/', '']
+        parts = ['a', 'Z', '9', '-', '_', '.', '.', ':', '/', '?', ' ', '\n',
+                 'п', '١', 'ſ', '@', 'localhost', '.com', ':80', 'ab' * 32]
+        for i in range(20000):
+            url = rnd.choice(prefixes) + ''.join(
+                rnd.choice(parts) for _ in range(rnd.randint(0, 12)))
+            self.assertEqual(
+                f(url), bool(urlfuncs3.DJANGO_URL_REGEX.search(url)), url)
+
+    def test_iter_url_list(self):
+        f = urlfuncs3.iter_url_list
+        lines = io.BytesIO(
+            ' http://test.com/ \n\nnot-valid-url\r\nhttp://привет.рф\n'.encode('utf-8'))
+        errors = []
+        rejects = io.StringIO()
+        self.assertEqual(
+            list(f(lines, on_error=lambda *args: errors.append(args),
+                   rejects=rejects)),
+            [(1, 'http://test.com/'), (4, 'http://привет.рф')])
+        self.assertEqual(errors, [(3, 'not-valid-url')])
+        self.assertEqual(rejects.getvalue(), 'not-valid-url\n')
+
+        with self.assertRaises(ValueError):
+            list(f(io.StringIO('http://a.com\nnot-valid-url\n')))
+
+    def test_iter_url_list_releases_stream(self):
+        text = 'http://ya.ru/привет\nhttp://i.ua/мир\n' * 50
+        lines = io.BytesIO(text.encode('cp1251'))
+        stream = weakref.ref(lines)
+        errors = []
+        urls = list(urlfuncs3.iter_url_list(
+            lines, on_error=lambda *args: errors.append(args)))
+        self.assertEqual(len(urls) + len(errors), 100)
+        lines.close()
+        del lines
+        gc.collect()
+        self.assertIsNone(stream())
+
+    def test_iter_domain_list(self):
+        f = urlfuncs3.iter_domain_list
+        lines = io.StringIO('http://test.com/page\n\n-bad-\nwww.a.co.uk/\n')
+        errors = []
+        self.assertEqual(
+            list(f(lines, on_error=lambda *args: errors.append(args))),
+            [(1, 'test.com'), (4, 'www.a.co.uk')])
+        self.assertEqual(errors, [(3, '-bad-')])
+
+        errors = []
+        rejects = io.StringIO()
+        lines = ['http://[bad/', 'a.com', 'http://-bad-/page']
+        self.assertEqual(
+            list(f(lines, on_error=lambda *args: errors.append(args),
+                   rejects=rejects)),
+            [(2, 'a.com')])
+        self.assertEqual(errors, [(1, 'http://[bad/'),
+                                  (3, 'http://-bad-/page')])
+        self.assertEqual(rejects.getvalue(),
+                         'http://[bad/\nhttp://-bad-/page\n')
+        with self.assertRaises(ValueError):
+            list(f(['http://[bad/']))
+
+    def test_validate_many(self):
+        f = urlfuncs3.validate_many
+        urls = ['http://ya.ru', 'i.ua/', 'http://привет.рф/', ''] * 50
+        expected = [urlfuncs3.is_string_url(url) for url in urls]
+        self.assertEqual(list(f(urls, workers=1)), expected)
+        self.assertEqual(list(f(iter(urls), workers=2, chunksize=7)), expected)
+        with self.assertRaises(ValueError):
+            list(f(urls, workers=0))
+
+    def test_clean_many(self):
+        f = urlfuncs3.clean_many
+        urls = ['   http://ya.ru/  ', 'www.atape.net/test/'] * 50
+        expected = ['ya.ru', 'atape.net/test'] * 50
+        self.assertEqual(list(f(urls, workers=1)), expected)
+        self.assertEqual(list(f(urls, workers=2, chunksize=9)), expected)
+
+    def test_get_public_suffix(self):
+        f = urlfuncs3.get_public_suffix
+        self.assertEqual(f('example.com.au'), 'com.au')
+        self.assertEqual(f('foo.bar.co'), 'co')
+        self.assertEqual(f('http://user@www.Google.co.uk:80/x'), 'co.uk')
+        self.assertEqual(f('foo.unknowntld'), 'unknowntld')
+        # Wildcard and exception rules
+        self.assertEqual(f('a.b.kawasaki.jp'), 'b.kawasaki.jp')
+        self.assertEqual(f('city.kawasaki.jp'), 'kawasaki.jp')
+        self.assertEqual(f('www.ck'), 'ck')
+        # IDN in both forms
+        self.assertEqual(f('http://привет.рф/'), 'рф')
+        self.assertEqual(f('http://xn--b1agh1afp.xn--p1ai/'), 'xn--p1ai')
+        self.assertEqual(f(''), None)
+
+    def test_get_registrable_domain(self):
+        f = urlfuncs3.get_registrable_domain
+        self.assertEqual(f('http://www.example.com.au/'), 'example.com.au')
+        self.assertEqual(f('foo.bar.co'), 'bar.co')
+        self.assertEqual(f('x.city.kawasaki.jp'), 'city.kawasaki.jp')
+        self.assertEqual(f('a.www.ck'), 'www.ck')
+        self.assertEqual(f('co.uk'), None)
+        self.assertEqual(f('b.kawasaki.jp'), None)
+
+    def test_domain_set(self):
+        domains = urlfuncs3.parse_domain_list(
+            'http://example.com/\nblog.test.org\nпривет.рф\n')
+        f = urlfuncs3.DomainSet(domains)
+        self.assertEqual(len(f), 3)
+        self.assertTrue(f.matches('https://www.Example.com:8080/page'))
+        self.assertTrue(f.matches('example.com.'))
+        self.assertFalse(f.matches('http://evil-example.com/'))
+        self.assertFalse(f.matches('http://example.com.evil.net/'))
+        self.assertFalse(f.matches('test.org'))
+        self.assertEqual(f.match('a.blog.test.org'), 'blog.test.org')
+        self.assertEqual(f.match('http://xn--b1agh1afp.xn--p1ai/'),
+                         'xn--b1agh1afp.xn--p1ai')
+        self.assertTrue(f.matches('http://www.привет.рф/'))
+        self.assertIn('EXAMPLE.com', f)
+        self.assertNotIn('www.example.com', f)
+        self.assertEqual(
+            f.matches_many(['http://a.example.com', 'i.ua', 'blog.test.org']),
+            [True, False, True])
+        # URL rejected by urlparse matches nothing
+        self.assertEqual(f.matches_many(['http://a.example.com', 'http://[x/']),
+                         [True, False])
+        self.assertEqual(f.match_many(['http://[x/']), [None])
+        self.assertNotIn('http://[x/', f)
+
+        f.add('test.org')
+        self.assertTrue(f.matches('test.org'))
+        f.remove('test.org')
+        self.assertFalse(f.matches('test.org'))
+        with self.assertRaises(KeyError):
+            f.remove('test.org')
+        f.discard('test.org')
+        with self.assertRaises(ValueError):
+            f.add('')
+
+    def test_public_suffix_list_save_load(self):
+        psl = urlfuncs3.PublicSuffixList.parse(
+            '// comment\ncom\nco.uk\n*.ck\n!www.ck\n')
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            psl.save(path)
+            loaded = urlfuncs3.PublicSuffixList.load(path)
+            f = urlfuncs3.get_registrable_domain
+            self.assertEqual(f('a.b.co.uk', loaded), 'b.co.uk')
+            self.assertEqual(f('a.b.ck', loaded), 'a.b.ck')
+            self.assertEqual(f('a.www.ck', loaded), 'www.ck')
+            self.assertEqual(f('a.b.com.au', loaded), 'com.au')
+            loaded.close()
+        finally:
+            os.remove(path)
+        with self.assertRaises(ValueError):
+            urlfuncs3.PublicSuffixList.load(urlfuncs3.PSL_FILE)
+
+        # Truncated header or columns
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'psl.bin')
+            psl.save(path)
+            with open(path, 'rb') as psl_file:
+                data = psl_file.read()
+            for size in (4, 30, len(data) - 1):
+                with open(path, 'wb') as psl_file:
+                    psl_file.write(data[:size])
+                with self.assertRaises(ValueError):
+                    urlfuncs3.PublicSuffixList.load(path)
+
+    def test_lazy_imports(self):
+        # chardet is imported only when charset detection is needed
+        code = ('import sys, urlfuncs3; '
+                'assert "chardet" not in sys.modules; '
+                'assert "concurrent.futures" not in sys.modules; '
+                'urlfuncs3.decode_string("кои8р".encode("koi8-r")); '
+                'assert "chardet" in sys.modules')
+        subprocess.check_call([sys.executable, '-c', code],
+                              cwd=os.path.dirname(os.path.abspath(__file__)))
+
+    def test_import_without_chardet(self):
+        code = ('import sys; sys.modules["chardet"] = None; import urlfuncs3; '
+                'assert urlfuncs3.is_string_url("http://привет.рф/"); '
+                'assert urlfuncs3.decode_string("тест".encode("cp1251")) == "тест"')
+        subprocess.check_call([sys.executable, '-c', code],
+                              cwd=os.path.dirname(os.path.abspath(__file__)))
+
+    def test_lazy_regex(self):
+        regex = urlfuncs3._LazyRegex('TEST_REGEX', r'^a+$')
+        self.assertTrue(regex.match('aaa'))
+        self.assertEqual(regex.pattern, '^a+$')
+        self.assertIs(urlfuncs3.TEST_REGEX, regex._compiled)
+        del urlfuncs3.TEST_REGEX
+
+    def test_canonical_url_key(self):
+        f = urlfuncs3.canonical_url_key
+        self.assertEqual(f('https://www.site.com/page/'), 'site.com/page')
+        self.assertEqual(f('http://site.com/page'), f('site.com/page/'))
+
+    def test_dedupe_urls(self):
+        urls = ['http://www.a%d.com/' % (i % 50) for i in range(300)]
+        urls += ['https://a%d.com' % i for i in range(100)]
+        expected = ['http://www.a%d.com/' % i for i in range(50)]
+        expected += ['https://a%d.com' % i for i in range(50, 100)]
+        self.assertEqual(list(urlfuncs3.dedupe_urls(urls)), expected)
+
+        dedup = urlfuncs3.URLDeduplicator(max_items=20)
+        result = list(dedup.dedupe(urls))
+        self.assertEqual(result[:20], expected[:20])
+        self.assertEqual(sorted(result), sorted(expected))
+        stats = dedup.stats()
+        self.assertEqual(stats['seen'], 400)
+        self.assertEqual(stats['unique'], 100)
+        self.assertEqual(stats['duplicates'], 300)
+        self.assertTrue(stats['runs'] > 1)
+        self.assertTrue(stats['peak_memory'] > 0)
+
+        dedup = urlfuncs3.URLDeduplicator(urlfuncs3.DEDUP_BLOOM, capacity=1000,
+                                          error_rate=0.0001)
+        self.assertEqual(list(dedup.dedupe(urls)), expected)
+        self.assertRaises(ValueError, urlfuncs3.URLDeduplicator, 'other')
+
+    def test_bloom_filter(self):
+        bloom = urlfuncs3.BloomFilter(1000, 0.01)
+        self.assertTrue(bloom.add('http://www.site.com/'))
+        self.assertFalse(bloom.add('https://site.com'))
+        self.assertIn('site.com', bloom)
+        self.assertNotIn('other.com', bloom)
+        self.assertEqual(len(bloom), 1)
+        self.assertEqual(bloom.add_many(['a.com', 'b.com', 'www.a.com']),
+                         [True, True, False])
+        self.assertEqual(bloom.contains_many(['a.com/', 'c.com']),
+                         [True, False])
+
+        bloom = urlfuncs3.BloomFilter(1000, 0.01, key=None)
+        bloom.add(b'site.com')
+        self.assertIn('site.com', bloom)
+        self.assertNotIn('www.site.com', bloom)
+
+    def test_bloom_filter_error_rate(self):
+        bloom = urlfuncs3.BloomFilter(10000, 0.01)
+        bloom.add_many('site%d.com' % i for i in range(10000))
+        self.assertTrue(all(bloom.contains_many(
+            'site%d.com' % i for i in range(10000))))
+        false_positives = sum(bloom.contains_many(
+            'other%d.com' % i for i in range(10000)))
+        self.assertTrue(false_positives < 200)
+
+    def test_bloom_filter_save_load(self):
+        bloom = urlfuncs3.BloomFilter(1000)
+        bloom.add_many(['a.com', 'b.com/page'])
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'seen.bloom')
+            bloom.save(path)
+            loaded = urlfuncs3.BloomFilter.load(path)
+            self.assertEqual(len(loaded), 2)
+            self.assertEqual(loaded.hashes, bloom.hashes)
+            self.assertEqual(loaded.contains_many(
+                ['http://a.com/', 'b.com/page', 'c.com']), [True, True, False])
+            self.assertRaises(TypeError, loaded.add, 'c.com')
+            loaded.close()
+            with open(path, 'wb') as bloom_file:
+                bloom_file.write(b'not a filter' * 10)
+            self.assertRaises(ValueError, urlfuncs3.BloomFilter.load, path)
+            # Truncated header
+            with open(path, 'wb') as bloom_file:
+                bloom_file.write(b'URLFBLM1\0\0')
+            self.assertRaises(ValueError, urlfuncs3.BloomFilter.load, path)
+
+    def test_aiter_url_list(self):
+        async def lines():
+            yield b'http://site.com/\n'
+            yield 'http://сайт.рф/\n'.encode('utf-8')
+            yield b'\n'
+            yield b'not url\n'
+            yield b'https://other.com/page\n'
+
+        async def collect():
+            return [url async for url in urlfuncs3.aiter_url_list(
+                lines(), on_error=lambda *args: errors.append(args),
+                chunksize=2)]
+        errors = []
+        self.assertEqual(asyncio.run(collect()), [
+            (1, 'http://site.com/'),
+            (2, 'http://сайт.рф/'),
+            (5, 'https://other.com/page')])
+        self.assertEqual(errors, [(4, 'not url')])
+
+        async def collect_invalid():
+            return [url async for url in urlfuncs3.aiter_url_list(
+                'http://site.com\nnot url')]
+        self.assertRaises(ValueError, asyncio.run, collect_invalid())
+
+    def test_avalidate_clean_many(self):
+        urls = ['http://www.site%d.com/' % i for i in range(100)] + ['bad']
+
+        async def collect(func, **kwargs):
+            return [result async for result in func(urls, **kwargs)]
+        self.assertEqual(
+            asyncio.run(collect(urlfuncs3.avalidate_many, chunksize=7)),
+            [True] * 100 + [False])
+        with concurrent.futures.ThreadPoolExecutor(2) as executor:
+            self.assertEqual(
+                asyncio.run(collect(urlfuncs3.aclean_many, executor=executor,
+                                    max_pending=3)),
+                list(urlfuncs3.clean_many(urls, workers=1)))
+
+    def test_instrumentation(self):
+        original = urlfuncs3.is_string_url
+        self.assertIsNone(urlfuncs3.instrumentation_stats())
+        self.assertEqual(urlfuncs3.instrumentation_prometheus(), '')
+        urlfuncs3.enable_instrumentation()
+        try:
+            self.assertIsNot(urlfuncs3.is_string_url, original)
+            self.assertTrue(urlfuncs3.is_string_url('http://site.com/'))
+            self.assertFalse(urlfuncs3.is_string_url('http://bad/'))
+            self.assertEqual(urlfuncs3.decode_string(b'\xff\xfe\xfa'),
+                             urlfuncs3.decode_string(b'\xff\xfe\xfa'))
+            urlfuncs3.decode_url('http://a..com/')
+            stats = urlfuncs3.instrumentation_stats()
+            calls = stats['functions']['is_string_url']
+            self.assertEqual(calls['calls'], 2)
+            self.assertTrue(calls['total'] >= calls['max'] > 0)
+            self.assertEqual(stats['events']['url_rejected'], 1)
+            self.assertEqual(stats['events']['chardet_detection'], 2)
+            self.assertEqual(stats['events']['idna_failure'], 1)
+            text = urlfuncs3.instrumentation_prometheus()
+            self.assertIn('urlfuncs3_calls_total{function="is_string_url"} 2',
+                          text)
+            self.assertIn('urlfuncs3_events_total{event="url_rejected"} 1',
+                          text)
+            self.assertRaises(ValueError, urlfuncs3.enable_instrumentation,
+                              ['_memoize'])
+        finally:
+            urlfuncs3.disable_instrumentation()
+        self.assertIs(urlfuncs3.is_string_url, original)
+        self.assertIsNone(urlfuncs3.instrumentation_stats())
+
+    def test_url_table(self):
+        urls = ['http://www.site.com/path?q=1#top', 'https://site.com',
+                'http://site.co.uk:8080/a/b', 'http://пример.рф/путь?а=б',
+                'http://www.site.com/other/']
+        table = urlfuncs3.URLTable(urls)
+        self.assertEqual(len(table), 5)
+        self.assertEqual(list(table), urls)
+        self.assertEqual(table[-1], urls[-1])
+        self.assertRaises(IndexError, table.__getitem__, 5)
+        self.assertEqual(len(table.hosts), 4)
+        self.assertEqual(table.get_url_domains(),
+                         [urlfuncs3.get_url_domain(url) for url in urls])
+        self.assertIs(table.get_url_domains()[0], table.get_url_domains()[4])
+        self.assertEqual(table.split_urls(),
+                         [urlfuncs3.split_url(url) for url in urls])
+        self.assertEqual(table.split_urls(False),
+                         [urlfuncs3.split_url(url, False) for url in urls])
+        self.assertEqual(table.get_domain_zones(),
+                         [urlfuncs3.get_domain_zone(url) for url in urls])
+        for index, url in enumerate(urls):
+            self.assertEqual(table.parts(index),
+                             tuple(urllib.parse.urlsplit(url)))
+        self.assertRaises(ValueError, table.append, 'not url')
+        self.assertTrue(table.memory_usage() > 0)
+
+        # Lone surrogate is stored and read back as is
+        url = 'http://a.com/\udc80x'
+        table = urlfuncs3.URLTable([url])
+        self.assertEqual(table[0], url)
+        self.assertEqual(list(table), [url])
+        self.assertEqual(table.split_urls(), [('a.com', '/\udc80x')])
+
+    def test_url_table_from_lines(self):
+        errors = []
+        table = urlfuncs3.URLTable.from_lines(
+            'http://a.com/\nbad\nhttp://b.com/x\n',
+            on_error=lambda *args: errors.append(args))
+        self.assertEqual(list(table), ['http://a.com/', 'http://b.com/x'])
+        self.assertEqual(errors, [(2, 'bad')])
+
+    def test_bytes_domain_functions(self):
+        for url in (b'http://www.site.com/path', bytearray(b'http://site.com'),
+                    memoryview(b'https://site.com:8080/?q=1')):
+            domain = urlfuncs3.get_url_domain(url)
+            self.assertEqual(domain,
+                             urlfuncs3.get_url_domain(bytes(url).decode()))
+            self.assertIsInstance(domain, str)
+        self.assertEqual(
+            urlfuncs3.get_url_domain('http://пример.рф/'.encode('utf-8')),
+            'пример.рф')
+        self.assertRaises(ValueError, urlfuncs3.get_url_domain, b'not url')
+
+        f = urlfuncs3.is_string_domain
+        self.assertTrue(f(b'site.com'))
+        self.assertTrue(f(memoryview(b'sub.site.com')))
+        self.assertTrue(f('пример.рф'.encode('utf-8')))
+        self.assertFalse(f(bytearray(b'1.1.1.1')))
+
+        f = urlfuncs3.get_root_domain_zone
+        self.assertEqual(f(b'http://www.site.co.uk/path'), 'uk')
+        self.assertEqual(f(memoryview(b'site.com')), 'com')
+        self.assertEqual(f('http://пример.рф/'.encode('utf-8')), 'рф')
+
+    def test_iter_log_urls(self):
+        lines = [
+            '1.2.3.4 - - "GET / HTTP/1.1" 200 5 "http://site.com/a?b=1" "UA"',
+            '1.2.3.5 - - "GET /x HTTP/1.1" 200 5 "-" "UA"',
+            'ref=<HTTPS://пример.рф/путь> xhttp://no.com http://bad',
+            'https://last.com/end',
+        ]
+        data = ('\n'.join(lines) + '\n').encode('utf-8')
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'access.log')
+            with open(path, 'wb') as log_file:
+                log_file.write(data)
+            urls = list(urlfuncs3.iter_log_urls(path))
+            self.assertEqual([url for _, url in urls], [
+                'http://site.com/a?b=1', 'HTTPS://пример.рф/путь',
+                'https://last.com/end'])
+            for offset, url in urls:
+                self.assertTrue(data[offset:].startswith(url.encode('utf-8')))
+            self.assertEqual(
+                [url for _, url in urlfuncs3.iter_log_urls(path,
+                                                           validate=False)],
+                ['http://site.com/a?b=1', 'HTTPS://пример.рф/путь',
+                 'http://bad', 'https://last.com/end'])
+            self.assertEqual(list(urlfuncs3.iter_log_domains(path)),
+                             ['site.com', 'пример.рф', 'last.com'])
+            # Nothing after end of range is read
+            offset = urls[0][0]
+            self.assertEqual(
+                list(urlfuncs3.iter_log_urls(path, 0, offset + 15,
+                                             validate=False)),
+                [(offset, 'http://site.com')])
+
+            for parts in range(1, 8):
+                ranges = urlfuncs3.split_log_file(path, parts)
+                self.assertTrue(len(ranges) <= parts)
+                self.assertEqual(ranges[0][0], 0)
+                self.assertEqual(ranges[-1][1], len(data))
+                for (_, end), (start, _) in zip(ranges, ranges[1:]):
+                    self.assertEqual(end, start)
+                    self.assertEqual(data[end - 1:end], b'\n')
+                self.assertEqual(
+                    [url for start, end in ranges
+                     for url in urlfuncs3.iter_log_urls(path, start, end)],
+                    urls)
+
+            bad = os.path.join(tmpdir, 'bad.log')
+            with open(bad, 'wb') as log_file:
+                log_file.write(b'"http://[bad/x" "http://ok.com/"\n')
+            for validate in (True, False):
+                self.assertEqual(
+                    list(urlfuncs3.iter_log_domains(bad, validate=validate)),
+                    ['ok.com'])
+
+            empty = os.path.join(tmpdir, 'empty.log')
+            open(empty, 'wb').close()
+            self.assertEqual(list(urlfuncs3.iter_log_urls(empty)), [])
+            self.assertEqual(urlfuncs3.split_log_file(empty, 4), [])
+
+    def test_find_urls(self):
+        f = urlfuncs3.find_urls
+        self.assertEqual(f('See http://site.com/page. Or https://site.com!'),
+                         ['http://site.com/page', 'https://site.com'])
+        self.assertEqual(
+            f('(https://en.wikipedia.org/wiki/Python_(language)) and '
+              '[ftp://files.org/x], {http://a.com/}'),
+            ['https://en.wikipedia.org/wiki/Python_(language)',
+             'ftp://files.org/x', 'http://a.com/'])
+        self.assertEqual(f('<a href="http://html.com/a">http://html.com/a</a>'),
+                         ['http://html.com/a', 'http://html.com/a'])
+        self.assertEqual(f('Go to www.example.com/path?x=1, or WWW.A.COM.'),
+                         ['www.example.com/path?x=1', 'WWW.A.COM'])
+        self.assertEqual(f('me@www.mail.com xhttp://no.com http://bad x.www.'),
+                         [])
+        self.assertEqual(f('Тут http://пример.рф/путь!'.encode('utf-8')),
+                         ['http://пример.рф/путь'])
+        self.assertEqual(f(''), [])
+        text = 'a http://site.com/ b www.site.com'
+        for offset, url in urlfuncs3.iter_urls(text):
+            self.assertEqual(text[offset:offset + len(url)], url)
+
+    def test_host_analytics(self):
+        urls = ['http://www.site.co.uk/a', 'https://www.site.co.uk/b?c',
+                'site.com/path', 'ftp://user@files.com.ru:21/x',
+                'http://пример.рф/', 'http://[broken/']
+        hosts = [urlfuncs3.parse_url(url).loose_netloc for url in urls[:-1]]
+        zones = [urlfuncs3.get_domain_zone(url) for url in urls[:-1]]
+        root_zones = [urlfuncs3.get_root_domain_zone(url)
+                      for url in urls[:-1]]
+        numpy = urlfuncs3._NUMPY
+        try:
+            urlfuncs3._NUMPY = None
+            analytics = urlfuncs3.HostAnalytics(urls)
+            self.assertEqual(analytics.hosts(), hosts + [''])
+            self.assertEqual(analytics.zones(), zones + [''])
+            self.assertEqual(analytics.root_zones(), root_zones + [''])
+            self.assertEqual(analytics.counts(), {
+                'www.site.co.uk': 2, 'site.com': 1,
+                'user@files.com.ru:21': 1, 'пример.рф': 1, '': 1})
+            self.assertEqual(analytics.counts('root_zone'), {
+                'uk': 2, 'com': 1, 'ru:21': 1, 'рф': 1, '': 1})
+            self.assertRaises(ValueError, analytics.counts, 'path')
+        finally:
+            urlfuncs3._NUMPY = numpy
+
+    @unittest.skipIf(urlfuncs3._get_numpy() is None, 'NumPy is not installed')
+    def test_host_analytics_numpy(self):
+        import numpy
+        urls = ['http://www.site.co.uk/a', 'https://www.site.co.uk/b?c',
+                'site.com/path', 'ftp://files.com.ru:21/x;p',
+                'http://пример.рф/', 'a;b/c', ' http://x.com', 'http://[bad']
+        expected = urlfuncs3.HostAnalytics(iter(urls))
+        self.assertIsInstance(expected.hosts(), numpy.ndarray)
+        for column in (numpy.array(urls), numpy.array(urls, dtype=object),
+                       numpy.array([url.encode('utf-8') for url in urls])):
+            analytics = urlfuncs3.HostAnalytics(column)
+            self.assertEqual(analytics.hosts().tolist(),
+                             expected.hosts().tolist())
+            self.assertEqual(analytics.zones().tolist(),
+                             [urlfuncs3._analytics_host(url) and
+                              urlfuncs3.get_domain_zone(url) for url in urls])
+            self.assertEqual(analytics.counts('zone'),
+                             expected.counts('zone'))
+
+        table = urlfuncs3.URLTable(urls[:2] + urls[3:5])
+        analytics = urlfuncs3.HostAnalytics(table)
+        self.assertEqual(analytics.hosts().tolist(), table.get_url_domains())
+        self.assertEqual(analytics.zones().tolist(), table.get_domain_zones())
+
+    def test_classify_host(self):
+        f = urlfuncs3.classify_host
+        self.assertEqual(f('http://www.site.com/a'), urlfuncs3.HOST_URL)
+        self.assertEqual(f('http://[::1]/'), urlfuncs3.HOST_INVALID)
+        self.assertEqual(f('http://[bad/'), urlfuncs3.HOST_INVALID)
+        self.assertEqual(f('site.co.uk'), urlfuncs3.HOST_DOMAIN)
+        self.assertEqual(f('привет.рф'.encode('utf-8')), urlfuncs3.HOST_DOMAIN)
+        self.assertEqual(f('192.168.0.1'), urlfuncs3.HOST_IPV4)
+        self.assertEqual(f(memoryview(b'10.0.0.255')), urlfuncs3.HOST_IPV4)
+        self.assertEqual(f('256.0.0.1'), urlfuncs3.HOST_INVALID)
+        self.assertEqual(f('1a2b3c4'), urlfuncs3.HOST_INVALID)
+        self.assertEqual(f('[2001:db8::1]'), urlfuncs3.HOST_IPV6)
+        self.assertEqual(f('fe80::1%eth0'), urlfuncs3.HOST_IPV6)
+        self.assertEqual(f('[fe80::zz]'), urlfuncs3.HOST_INVALID)
+        self.assertEqual(f('LocalHost'), urlfuncs3.HOST_LOCALHOST)
+        self.assertEqual(f(''), urlfuncs3.HOST_INVALID)
+        self.assertEqual(f('spaced text'), urlfuncs3.HOST_INVALID)
+        self.assertEqual(f(urlfuncs3.parse_url('a.com')),
+                         urlfuncs3.HOST_DOMAIN)
+
+    def test_host_predicates_strict_ipv4(self):
+        self.assertFalse(urlfuncs3.is_string_ipv4('1a2b3c4'))
+        self.assertFalse(urlfuncs3.is_string_ipv4('256.1.1.1'))
+        self.assertFalse(urlfuncs3.is_string_ipv4('1..1.1'))
+        self.assertTrue(urlfuncs3.is_string_ipv4(b'127.0.0.1'))
+        self.assertTrue(urlfuncs3.is_string_domain('localhost'))
+        self.assertFalse(urlfuncs3.is_string_domain('[::1]'))
+        self.assertFalse(urlfuncs3.is_url_or_domain_valid('127.0.0.1'))
+        self.assertFalse(urlfuncs3.is_url_or_domain_valid('//[bad'))
+        self.assertFalse(urlfuncs3.is_string_url('http://[bad/'))
+        self.assertFalse(urlfuncs3.is_string_ipv4('http://1.2.3.4/'))
+        self.assertTrue(urlfuncs3.is_string_ipv4(
+            urlfuncs3.ParsedURL('001.2.3.255')))
+        self.assertFalse(urlfuncs3.is_string_domain('http://ya.ru/'))
+        self.assertFalse(urlfuncs3.is_string_domain(b'http://[bad/'))
+
+    def test_url_normalizer(self):
+        urls = ['   http://ya.ru/  ', 'www.atape.net/test/', 'www.', 'www./',
+                'https://www.привет.рф/', 'http://a.com/?u=https://b.com/',
+                'ftp://www.a.com//', 'HTTP://www.a.com', 'www.a.com\nb',
+                'https://www.ya.ru', ' https://', '']
+        f = urlfuncs3.URLNormalizer()
+        self.assertEqual(f.steps, urlfuncs3.FULL_CLEAN_STEPS)
+        for url in urls:
+            cleaned = url.strip()
+            cleaned = urlfuncs3.remove_http(cleaned)
+            cleaned = urlfuncs3.remove_last_slash(cleaned)
+            cleaned = urlfuncs3.remove_www(cleaned)
+            self.assertEqual(f.normalize(url), cleaned)
+            self.assertEqual(urlfuncs3.full_clean_url(url), cleaned)
+        for step, func in ((urlfuncs3.NORMALIZE_SCHEME, urlfuncs3.remove_http),
+                           (urlfuncs3.NORMALIZE_WWW, urlfuncs3.remove_www)):
+            f = urlfuncs3.URLNormalizer([step])
+            for url in urls:
+                self.assertEqual(f.normalize(url), func(url))
+
+        f = urlfuncs3.URLNormalizer(reversed(urlfuncs3.NORMALIZE_STEPS))
+        self.assertEqual(f.steps, urlfuncs3.NORMALIZE_STEPS)
+        self.assertEqual(f.normalize(' http://www.A.com:80/#top '), 'a.com')
+        self.assertEqual(f.normalize('https://WWW.Ya.RU:443/Path/?q=A#x'),
+                         'ya.ru/Path/?q=A')
+        self.assertEqual(f.normalize('https://User@Ya.ru:80/'),
+                         'User@ya.ru:80')
+        self.assertEqual(f.normalize('[::1]:80/'), '[::1]')
+        f = urlfuncs3.URLNormalizer([urlfuncs3.NORMALIZE_PORT,
+                                     urlfuncs3.NORMALIZE_LOWER_HOST])
+        self.assertEqual(f.normalize('HTTPS://Ex.com:443/a'),
+                         'HTTPS://ex.com/a')
+        self.assertEqual(f.normalize('Http://Ex.com:80'), 'Http://ex.com')
+        f = urlfuncs3.URLNormalizer([urlfuncs3.NORMALIZE_FRAGMENT,
+                                     urlfuncs3.NORMALIZE_SLASH])
+        self.assertEqual(f.normalize('http://a.com/b/#c/'), 'http://a.com/b')
+        with self.assertRaises(ValueError):
+            urlfuncs3.URLNormalizer(['scheme', 'query'])
+
+    def test_normalize_many(self):
+        f = urlfuncs3.normalize_many
+        urls = ['http://www.ya.ru/', urlfuncs3.ParsedURL('https://a.com//'),
+                'www.b.com:80/#x']
+        self.assertEqual(f(urls), ['ya.ru', 'a.com', 'b.com:80/#x'])
+        self.assertEqual(f(iter(urls), steps=urlfuncs3.NORMALIZE_STEPS),
+                         ['ya.ru', 'a.com', 'b.com'])
+        self.assertEqual(f([]), [])
+
+
+    def test_split_urls(self):
+        f = urlfuncs3.split_urls
+        urls = ['http://domain.zone/section?p=2',
+                'https://www.test.com/hello?t=5&r=6#anchor',
+                urlfuncs3.ParsedURL('ftp://www.стенгазета.рф/test/'),
+                'https://www.test.com:8080',
+                'http://1.2.3.4:80/a.com/x']
+        for clean_domain in (True, False):
+            splitted = [urlfuncs3.split_url(url, clean_domain)
+                        for url in urls]
+            self.assertEqual(
+                f(iter(urls), clean_domain),
+                ([domain for domain, uri in splitted],
+                 [uri for domain, uri in splitted]))
+        self.assertEqual(f(['https://www.a.com/www.a.com/']),
+                         (['a.com'], ['/www.a.com/']))
+        self.assertEqual(f([]), ([], []))
+
+        urls = ['http://a.com/b', 'i.ua/', 'https://c.org']
+        self.assertEqual(f(urls, invalid=None),
+                         (['a.com', None, 'c.org'], ['/b', None, '']))
+        with self.assertRaises(ValueError):
+            f(urls)
+
+    def test_url_variants(self):
+        variants = urlfuncs3.url_variants('https://www.test.com/hello/')
+        self.assertEqual(len(variants), 8)
+        self.assertEqual(variants[0], 'http://test.com/hello')
+        self.assertEqual(variants[-1], 'https://www.test.com/hello/')
+        url = 'http://test.com/hello'
+        toggled = {url, urlfuncs3.toggle_url_www(url)}
+        toggled |= {urlfuncs3.toggle_last_url_slash(url) for url in toggled}
+        toggled |= {url.replace('http://', 'https://') for url in toggled}
+        self.assertEqual(set(variants), toggled)
+        keys = set(map(urlfuncs3.canonical_url_key, variants))
+        self.assertEqual(keys, {'test.com/hello'})
+
+    def test_url_index(self):
+        f = urlfuncs3.URLIndex(['http://a.com/', 'https://www.a.com',
+                                'http://a.com/', 'b.org/x'])
+        self.assertEqual(len(f), 3)
+        self.assertEqual(list(f),
+                         ['http://a.com/', 'https://www.a.com', 'b.org/x'])
+        self.assertIn('https://a.com//', f)
+        self.assertNotIn('http://a.com/b', f)
+        self.assertEqual(f.lookup(urlfuncs3.ParsedURL('www.a.com')),
+                         ['http://a.com/', 'https://www.a.com'])
+        self.assertEqual(f.lookup('c.com'), [])
+
+        self.assertTrue(f.add('https://b.org/x/'))
+        self.assertFalse(f.add('https://b.org/x/'))
+        self.assertEqual(f.add_many(['http://c.com', 'b.org/x', 'c.com/']), 2)
+        self.assertEqual(len(f), 6)
+        found = f.lookup_many(iter(['https://www.b.org/x', 'www.c.com',
+                                    'http://d.com']))
+        self.assertEqual(found, [['b.org/x', 'https://b.org/x/'],
+                                 ['http://c.com', 'c.com/'], []])
+        found[0].append('changed')
+        self.assertEqual(len(f.lookup('b.org/x')), 2)
+
+        f = urlfuncs3.URLIndex(['http://A.com/x', 'http://a.com/x'],
+                               key=str.lower)
+        self.assertEqual(f.lookup('HTTP://A.COM/X'),
+                         ['http://A.com/x', 'http://a.com/x'])
 
 if __name__ == "__main__":
     # import sys;sys.argv = ['', 'Test.testName']
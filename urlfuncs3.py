@@ -3,15 +3,70 @@
 This module contains useful functions for any url-related jobs.
 """
 
+import array
+import collections
+import heapq
+import itertools
+import math
+import mmap
+import os
 import re
+import struct
+import sys
+import threading
+import time
 import urllib.parse
-import chardet
+
+
+class _LazyRegex(object):
+    """ Module regex compiled on first use to keep import fast.
+
+    First use also replaces the module global with compiled pattern,
+    so later calls do not go through this proxy at all.
+    """
+
+    __slots__ = ('_name', '_args', '_compiled')
+
+    def __init__(self, name, pattern, flags=0):
+        self._name = name
+        self._args = (pattern, flags)
+        self._compiled = None
+
+    def __getattr__(self, attr):
+        compiled = self._compiled
+        if compiled is None:
+            compiled = self._compiled = re.compile(*self._args)
+            globals()[self._name] = compiled
+        return getattr(compiled, attr)
+
 
 POPULAR_ENCODINGS = ('utf-8', 'ascii')
 
-REMOVE_WWW_PATTERN = re.compile('^(http(s)?://)?w{3}\.(.+)')
+# Encodings tried in order when charset detection failed or chardet is
+# not installed, ISO-8859-1 decodes any bytes
+FALLBACK_ENCODINGS = ('cp1251', 'ISO-8859-1')
+
+# Max number of bytes given to chardet, None for the whole string,
+# the sample is fed in chunks until chardet is sure about encoding
+CHARSET_SAMPLE_SIZE = 64 * 1024
+CHARSET_CHUNK_SIZE = 4096
+
+# Max number of sources to remember detected encoding for
+SOURCE_ENCODINGS_CACHE_SIZE = 1024
+
+# Max number of non-ASCII netlocs to remember IDNA form of
+IDNA_CACHE_SIZE = 4096
+
+REMOVE_WWW_PATTERN = _LazyRegex(
+    'REMOVE_WWW_PATTERN', r'^(https?://)?w{3}\.(.+)')
+
+# Scheme, netloc, path with query and fragment of URLNormalizer input
+_NORMALIZE_URL_REGEX = _LazyRegex(
+    '_NORMALIZE_URL_REGEX',
+    r'(?:([A-Za-z][A-Za-z0-9+.-]*)://)?([^/?#]*)([^#]*)(#.*)?\Z', re.DOTALL)
 
-DJANGO_URL_REGEX = re.compile(
+DJANGO_URL_REGEX = _LazyRegex(
+    'DJANGO_URL_REGEX',
     r'^(?:http|ftp)s?://' # http:// or https://
     r'(?:(?:[A-Z0-9](?:[A-Z0-9-]{0,61}[A-Z0-9])?\.)+'
         r'(?:[A-Z]{2,6}\.?|[A-Z0-9-]{2,}\.?)|'
@@ -21,76 +76,800 @@ DJANGO_URL_REGEX = re.compile(
     r'(?::\d+)?' # optional port
     r'(?:/?|[/?]\S+)$', re.IGNORECASE | re.UNICODE)
 
-DOMAIN_REGEX = re.compile(
+DOMAIN_REGEX = _LazyRegex(
+    'DOMAIN_REGEX',
     r'^(?:(?:[A-Z0-9](?:[A-Z0-9-]{0,61}[A-Z0-9])?\.)+'
         r'(?:[A-Z]{2,6}\.?|[A-Z0-9-]{2,}\.?)|'
     r'(?:[^\W_](?:[^\W_-]{0,61}[^\W_])?\.)+'
         r'(?:[^\W_]{2,6}\.?|[^\W_-]{2,}\.?)|'
     r'localhost)$', re.IGNORECASE | re.UNICODE)
 
-IPV4_REGEX = re.compile(
+# DJANGO_URL_REGEX split into flat parts without nested quantifiers,
+# hostname grammar is checked by is_url_syntax_valid itself
+URL_HOST_REGEX = _LazyRegex(
+    'URL_HOST_REGEX',
+    r'(?i:(?:http|ftp)s?)://'
+    r'([\w.-]+)', re.UNICODE)
+
+URL_TAIL_REGEX = _LazyRegex(
+    'URL_TAIL_REGEX',
+    r'(?::\d+)?' # optional port
+    r'(?:/?|[/?]\S+)$', re.IGNORECASE | re.UNICODE)
+
+# Shortcuts of _url_host for strings urlparse would split the same way
+_PLAIN_HOST_REGEX = _LazyRegex('_PLAIN_HOST_REGEX', r'[\w.-]+\Z', re.UNICODE)
+
+_URL_NETLOC_REGEX = _LazyRegex(
+    '_URL_NETLOC_REGEX',
+    r'(?:[A-Za-z][A-Za-z0-9+.-]*:)?//([^/?#\t\n\r\[\]]*)(?:[/?#]|\Z)')
+
+# URL in log file: '://' and its tail, scheme before it
+_LOG_URL_TAIL_REGEX = _LazyRegex('_LOG_URL_TAIL_REGEX', rb'://[^\s"\'<>]+')
+
+_LOG_URL_SCHEME_REGEX = _LazyRegex(
+    '_LOG_URL_SCHEME_REGEX', rb'(?:^|[^A-Za-z])((?i:https?|ftps?))\Z')
+
+# Longer runs of URL chars in text are skipped, to keep search linear
+MAX_TEXT_URL_LENGTH = 4096
+
+# URL in free text: '://' or 'www.' marker, scheme before it and its tail
+_TEXT_URL_MARKER_REGEX = _LazyRegex(
+    '_TEXT_URL_MARKER_REGEX', r'://|[Ww][Ww][Ww]\.')
+
+_TEXT_URL_SCHEME_REGEX = _LazyRegex(
+    '_TEXT_URL_SCHEME_REGEX', r'(?:^|[^A-Za-z])((?i:https?|ftps?))\Z')
+
+_TEXT_URL_TAIL_REGEX = _LazyRegex('_TEXT_URL_TAIL_REGEX', r'[^\s<>"]*')
+
+# Chars trimmed from the end of URL found in text
+_TRAILING_PUNCTUATION = '.,:;!?\'*'
+_CLOSING_BRACKETS = {')': '(', ']': '[', '}': '{'}
+
+# Longer URLs are rejected by is_string_url without any parsing,
+# None means unlimited (exactly as DJANGO_URL_REGEX)
+MAX_URL_LENGTH = None
+
+IPV4_REGEX = _LazyRegex(
+    'IPV4_REGEX',
     r'^[0-9]{0,3}.[0-9]{0,3}.[0-9]{0,3}.[0-9]{0,3}$',
     re.UNICODE)
 
+# Four ASCII numbers up to 255 with dots, leading zeros allowed
+_IPV4_OCTETS_REGEX = _LazyRegex(
+    '_IPV4_OCTETS_REGEX',
+    r'(?:(?:[0-9]{1,2}|[01][0-9]{2}|2[0-4][0-9]|25[0-5])\.){3}'
+    r'(?:[0-9]{1,2}|[01][0-9]{2}|2[0-4][0-9]|25[0-5])\Z')
+
+# Public Suffix List bundled with the module, see PublicSuffixList
+PSL_FILE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'public_suffix_list.dat')
+
+# Compiled Public Suffix List file format, see PublicSuffixList.save
+_PSL_MAGIC = b'URLFPSL1'
+_PSL_HEADER = '<8sIII'
+_PSL_RULE = 1
+_PSL_EXCEPTION = 2
+
+# Header of BloomFilter file: magic, capacity, error rate, hashes, count, size
+_BLOOM_MAGIC = b'URLFBLM1'
+_BLOOM_HEADER = '<8sQdIQQ'
+
+# Public Suffix List used by default, loaded on first use
+_DEFAULT_PSL = None
+
+# Kinds of links returned by classify_links
+LINK_INTERNAL = 'internal'
+LINK_EXTERNAL = 'external'
+LINK_RELATIVE = 'relative'
+LINK_INVALID = 'invalid'
+
+# Kinds of strings returned by classify_host
+HOST_URL = 'url'
+HOST_DOMAIN = 'domain'
+HOST_IPV4 = 'ipv4'
+HOST_IPV6 = 'ipv6'
+HOST_LOCALHOST = 'localhost'
+HOST_INVALID = 'invalid'
+
+# Steps of URLNormalizer in the order they run
+NORMALIZE_STRIP = 'strip'
+NORMALIZE_SCHEME = 'scheme'
+NORMALIZE_FRAGMENT = 'fragment'
+NORMALIZE_PORT = 'port'
+NORMALIZE_LOWER_HOST = 'lower_host'
+NORMALIZE_SLASH = 'slash'
+NORMALIZE_WWW = 'www'
+NORMALIZE_STEPS = (NORMALIZE_STRIP, NORMALIZE_SCHEME, NORMALIZE_FRAGMENT,
+                   NORMALIZE_PORT, NORMALIZE_LOWER_HOST, NORMALIZE_SLASH,
+                   NORMALIZE_WWW)
+
+# Steps of full_clean_url
+FULL_CLEAN_STEPS = (NORMALIZE_STRIP, NORMALIZE_SCHEME, NORMALIZE_SLASH,
+                    NORMALIZE_WWW)
+
+# Schemes removed by remove_http and NORMALIZE_SCHEME
+_HTTP_SCHEMES = ('http', 'https')
+
+# Ports dropped by NORMALIZE_PORT, URLs without scheme count as http
+_DEFAULT_PORTS = {'http': ':80', 'https': ':443', None: ':80'}
+
+# Modes of URLDeduplicator
+DEDUP_EXACT = 'exact'
+DEDUP_BLOOM = 'bloom'
+
+# Bounds of automatically chosen batch size for validate_many/clean_many
+MIN_BULK_CHUNKSIZE = 256
+MAX_BULK_CHUNKSIZE = 16384
+
+# Batch size and max batches in executor of async API
+ASYNC_CHUNKSIZE = 512
+ASYNC_MAX_PENDING = 2
+
+# Bytes-like types accepted by bytes-native functions
+_BYTES_TYPES = (bytes, bytearray, memoryview)
+
+# Marker of not yet computed lazy value
+_UNSET = object()
+
+# chardet module imported on first use, see _get_chardet
+_CHARDET = _UNSET
+
+# numpy module imported on first use, see _get_numpy
+_NUMPY = _UNSET
+
+# Functions which results can be memoized with enable_cache
+CACHED_FUNCTIONS = ('decode_url', 'is_string_url', 'is_string_domain',
+                    'get_domain_zone')
+
+# Enabled caches by function name, empty while caching is off
+_CACHES = {}
+
+# Functions timed by enable_instrumentation by default
+INSTRUMENTED_FUNCTIONS = (
+    'decode_string', 'detect_encoding', 'decode_url', 'is_string_url',
+    'is_string_domain', 'is_url_syntax_valid', 'get_url_domain',
+    'get_domain_zone', 'full_clean_url', 'make_absolute_url',
+    'get_registrable_domain')
+
+# Enabled Instrumentation, None while instrumentation is off
+_INSTRUMENTATION = None
+
+
+class LRUCache(object):
+    """ Bounded thread-safe LRU cache with hit/miss/eviction counters.
+
+    Falsy results (invalid strings) are kept apart from truthy ones,
+    so a flood of junk input can not evict entries for valid input.
+    """
+
+    def __init__(self, maxsize=65536, negative_maxsize=None):
+        if negative_maxsize is None:
+            negative_maxsize = maxsize
+        if maxsize < 0 or negative_maxsize < 0:
+            raise ValueError('Cache size can not be negative')
+        self.maxsize = maxsize
+        self.negative_maxsize = negative_maxsize
+        self._positive = collections.OrderedDict()
+        self._negative = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._positive) + len(self._negative)
+
+    def get(self, key, default=None):
+        """ Get cached value and mark it as recently used
+
+        :param key: Cache key
+        :param default: Value to return on cache miss
+        :returns: Cached value or default
+        """
+        with self._lock:
+            for entries in (self._positive, self._negative):
+                try:
+                    value = entries[key]
+                except KeyError:
+                    continue
+                entries.move_to_end(key)
+                self.hits += 1
+                return value
+            self.misses += 1
+        return default
+
+    def set(self, key, value):
+        """ Store value, evicting least recently used entries if full
+
+        :param key: Cache key
+        :param value: Value to cache
+        """
+        if value:
+            entries, maxsize = self._positive, self.maxsize
+        else:
+            entries, maxsize = self._negative, self.negative_maxsize
+        with self._lock:
+            entries[key] = value
+            entries.move_to_end(key)
+            while len(entries) > maxsize:
+                entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """ Drop all entries and reset counters
+        """
+        with self._lock:
+            self._positive.clear()
+            self._negative.clear()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def stats(self):
+        """ Cache counters
+
+        :returns: dict with hits, misses, evictions and sizes
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'positive': len(self._positive),
+                'negative': len(self._negative),
+                'maxsize': self.maxsize,
+                'negative_maxsize': self.negative_maxsize,
+            }
+
+
+# Encodings detected by decode_string for sources of strings
+_SOURCE_ENCODINGS = LRUCache(SOURCE_ENCODINGS_CACHE_SIZE)
+
+# IDNA forms of non-ASCII netlocs, '' for netlocs IDNA fails on
+_IDNA_NETLOCS = LRUCache(IDNA_CACHE_SIZE)
+
+# Ids of streams of aiter_url_list as decode_string sources
+_STREAM_IDS = itertools.count()
+
+
+def enable_cache(maxsize=65536, negative_maxsize=None,
+                 functions=CACHED_FUNCTIONS):
+    """ Turn on memoization of validators, replacing existing caches
+
+    :param maxsize: Max number of valid (truthy) results per function
+    :param negative_maxsize: Max number of invalid results per function,
+        same as maxsize by default
+    :param functions: Names of functions from CACHED_FUNCTIONS to cache
+    """
+    for name in functions:
+        if name not in CACHED_FUNCTIONS:
+            raise ValueError('Function %s can not be cached' % name)
+    caches = dict((name, LRUCache(maxsize, negative_maxsize))
+                  for name in functions)
+    _CACHES.clear()
+    _CACHES.update(caches)
+
+
+def disable_cache():
+    """ Turn off memoization and drop all cached values
+    """
+    _CACHES.clear()
+
+
+def clear_cache():
+    """ Drop cached values and counters, leaving caching enabled
+    """
+    for cache in list(_CACHES.values()):
+        cache.clear()
+
+
+def cache_stats():
+    """ Counters of enabled caches
+
+    :returns: dict of LRUCache.stats() by function name
+    """
+    return dict((name, cache.stats())
+                for name, cache in list(_CACHES.items()))
+
+
+def _memoize(name, key, func, arg):
+    """ Call func(arg), memoized by key when cache of `name` is enabled
+    """
+    cache = _CACHES.get(name)
+    if cache is None:
+        return func(arg)
+    try:
+        value = cache.get(key, _UNSET)
+    except TypeError:
+        # Unhashable key, e.g. bytearray
+        return func(arg)
+    if value is _UNSET:
+        value = func(arg)
+        cache.set(key, value)
+    return value
+
+
+class Instrumentation(object):
+    """ Call counters and timings of instrumented functions,
+    and counters of rare branches (events) of the module.
+
+    Timings are inclusive: time of decode_url called by is_string_url
+    is counted for both of them.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._events = collections.Counter()
+        self._lock = threading.Lock()
+        self.originals = {}
+
+    def record(self, name, elapsed):
+        """ Count a call of function
+
+        :param name: Function name
+        :param elapsed: Call time in seconds
+        """
+        with self._lock:
+            stats = self._calls.get(name)
+            if stats is None:
+                self._calls[name] = [1, elapsed, elapsed]
+            else:
+                stats[0] += 1
+                stats[1] += elapsed
+                if elapsed > stats[2]:
+                    stats[2] = elapsed
+
+    def count(self, event):
+        """ Count an event
+
+        :param event: Event name, e.g. 'chardet_detection'
+        """
+        with self._lock:
+            self._events[event] += 1
+
+    def clear(self):
+        """ Reset all counters
+        """
+        with self._lock:
+            self._calls.clear()
+            self._events.clear()
+
+    def stats(self):
+        """ Counters snapshot
+
+        :returns: dict with calls, total and max seconds by function name,
+            counts by event name and cache_stats()
+        """
+        with self._lock:
+            functions = dict(
+                (name, {'calls': calls, 'total': total, 'max': longest})
+                for name, (calls, total, longest) in self._calls.items())
+            events = dict(self._events)
+        return {'functions': functions, 'events': events,
+                'caches': cache_stats()}
+
+    def _timed(self, name, func):
+        """ Wrapper of func recording its calls
+        """
+        perf_counter = time.perf_counter
+        record = self.record
+
+        def timed(*args, **kwargs):
+            started = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(name, perf_counter() - started)
+        timed.__name__ = func.__name__
+        timed.__doc__ = func.__doc__
+        timed.__wrapped__ = func
+        return timed
+
+
+def enable_instrumentation(functions=INSTRUMENTED_FUNCTIONS):
+    """ Turn on counting of calls, timings and rare branches
+
+    Functions are replaced in the module with timing wrappers, names
+    imported from the module before the call are not instrumented.
+    Counters of previous instrumentation are dropped.
+
+    :param functions: Names of module functions to time
+    """
+    module = sys.modules[__name__]
+    for name in functions:
+        if not callable(getattr(module, name, None)) or name.startswith('_'):
+            raise ValueError('Function %s can not be instrumented' % name)
+    disable_instrumentation()
+    global _INSTRUMENTATION
+    instrumentation = Instrumentation()
+    for name in functions:
+        func = getattr(module, name)
+        instrumentation.originals[name] = func
+        setattr(module, name, instrumentation._timed(name, func))
+    _INSTRUMENTATION = instrumentation
+
+
+def disable_instrumentation():
+    """ Turn off instrumentation, restoring original functions
+    """
+    global _INSTRUMENTATION
+    instrumentation = _INSTRUMENTATION
+    if instrumentation is not None:
+        _INSTRUMENTATION = None
+        module = sys.modules[__name__]
+        for name, func in instrumentation.originals.items():
+            setattr(module, name, func)
+
+
+def instrumentation_stats():
+    """ Counters of enabled instrumentation
 
-def decode_string(string):
+    :returns: dict, see Instrumentation.stats, None if it is off
+    """
+    instrumentation = _INSTRUMENTATION
+    if instrumentation is None:
+        return None
+    return instrumentation.stats()
+
+
+def instrumentation_prometheus():
+    """ Counters of enabled instrumentation in Prometheus text format
+
+    :returns: String with metrics, empty if instrumentation is off
+    """
+    stats = instrumentation_stats()
+    if stats is None:
+        return ''
+    lines = []
+
+    def metric(name, kind, help_text, label, values):
+        lines.append('# HELP urlfuncs3_%s %s' % (name, help_text))
+        lines.append('# TYPE urlfuncs3_%s %s' % (name, kind))
+        for key, value in sorted(values.items()):
+            lines.append('urlfuncs3_%s{%s="%s"} %r' % (
+                name, label, key, value))
+
+    functions = stats['functions']
+    caches = stats['caches']
+    metric('calls_total', 'counter', 'Calls of function', 'function',
+           dict((name, value['calls']) for name, value in functions.items()))
+    metric('call_seconds_total', 'counter', 'Total time of function calls',
+           'function',
+           dict((name, value['total']) for name, value in functions.items()))
+    metric('call_seconds_max', 'gauge', 'Longest call of function',
+           'function',
+           dict((name, value['max']) for name, value in functions.items()))
+    metric('events_total', 'counter', 'Rare branches taken', 'event',
+           stats['events'])
+    for counter in ('hits', 'misses', 'evictions'):
+        metric('cache_%s_total' % counter, 'counter', 'Cache %s' % counter,
+               'function', dict((name, value[counter])
+                                for name, value in caches.items()))
+    return '\n'.join(lines) + '\n'
+
+
+def _count_event(event):
+    """ Count rare branch event when instrumentation is on
+    """
+    instrumentation = _INSTRUMENTATION
+    if instrumentation is not None:
+        instrumentation.count(event)
+
+
+def decode_string(string, source=None):
     """ Universal method to decode strings to UNICODE
+
+    :param string: bytes, UNICODE string or ParsedURL
+    :param source: Hashable key of string origin, e.g. file name.
+        Encoding detected for a source is tried first for the
+        next strings of the same source. Keys are kept in a module
+        cache, so pass names rather than file objects.
+    :returns: UNICODE string or input value if nothing fits
     """
 
     if isinstance(string, str):
         return string
+    if isinstance(string, ParsedURL):
+        return decode_string(string.url, source)
 
+    encoding = None
+    if source is not None:
+        try:
+            encoding = _SOURCE_ENCODINGS.get(source)
+        except TypeError:
+            source = None
+    unicode_string, detected = _decode_bytes(string, encoding)
+    if detected is not None and source is not None:
+        _SOURCE_ENCODINGS.set(source, detected)
+    return unicode_string
+
+
+def _decode_bytes(string, source_encoding=None):
+    """ decode_string of bytes with encoding detected before for the same
+    source, returns (UNICODE string or input value, encoding detected by
+    chardet or None)
+    """
     # Set popular encodings list in frequency order
     for encoding in POPULAR_ENCODINGS:
-        try:
-            unicode_string = string.decode(encoding)
-            return unicode_string
-        except UnicodeDecodeError:
-            pass
-        except UnicodeEncodeError:
-            pass
+        unicode_string = _try_decode(string, encoding)
+        if unicode_string is not None:
+            return unicode_string, None
+
+    # Encoding detected before for the same source
+    if source_encoding is not None:
+        unicode_string = _try_decode(string, source_encoding)
+        if unicode_string is not None:
+            return unicode_string, None
 
     # If all decodings from popular list was failed
     # Try to detect encoding with chardet module
-    try:
-        enc = chardet.detect(string)
-        return string.decode(enc['encoding'])
-    except:
-        pass
+    _count_event('chardet_detection')
+    encoding = detect_encoding(string)
+    if encoding is not None:
+        unicode_string = _try_decode(string, encoding)
+        if unicode_string is not None:
+            return unicode_string, encoding
+
+    # Legacy encodings as the last resort
+    for encoding in FALLBACK_ENCODINGS:
+        unicode_string = _try_decode(string, encoding)
+        if unicode_string is not None:
+            _count_event('fallback_encoding')
+            return unicode_string, None
     # When all methods failed, just return input value
-    return string
+    _count_event('decode_failure')
+    return string, None
+
+
+def detect_encoding(data, sample_size=_UNSET):
+    """ Detect encoding of bytes with chardet looking at their sample only
+
+    :param data: bytes to detect encoding of
+    :param sample_size: Max number of bytes to look at,
+        CHARSET_SAMPLE_SIZE by default, None for all bytes
+    :returns: encoding name or None if unknown or chardet is not installed
+    """
+    chardet = _get_chardet()
+    if chardet is None:
+        return None
+    if sample_size is _UNSET:
+        sample_size = CHARSET_SAMPLE_SIZE
+    if sample_size is not None:
+        data = data[:sample_size]
+
+    try:
+        detector = chardet.UniversalDetector()
+        for start in range(0, len(data), CHARSET_CHUNK_SIZE):
+            detector.feed(data[start:start + CHARSET_CHUNK_SIZE])
+            if detector.done:
+                break
+        return detector.close()['encoding']
+    except Exception:
+        return None
+
+
+def _try_decode(string, encoding):
+    """ Decoded string or None if it is not in encoding
+    """
+    try:
+        return string.decode(encoding)
+    except (UnicodeError, LookupError):
+        return None
+
+
+def _get_chardet():
+    """ Import chardet on first use, it is slow to import and optional
+
+    :returns: chardet module or None if it is not installed
+    """
+    global _CHARDET
+    if _CHARDET is _UNSET:
+        try:
+            import chardet
+        except ImportError:
+            chardet = None
+        _CHARDET = chardet
+    return _CHARDET
 
 
 def decode_url(url):
     """ Universal function to decode URLS with IDNA
     """
+    if isinstance(url, ParsedURL):
+        return url.decoded
+    return _memoize('decode_url', url, _decode_url, url)
+
+
+def _decode_url(url):
+    """ Not memoized decode_url
+    """
     decoded_string = decode_string(url)
     parsed = urllib.parse.urlparse(decoded_string)
     if parsed.netloc:
         netloc = parsed.netloc
-        # Convert domain name via IDNA
-        try:
-            idna_netloc = netloc.encode("idna").decode()
-        except:
-            idna_netloc = netloc
+        idna_netloc = _idna_netloc(netloc)
         unicode_url = decoded_string.replace(netloc, idna_netloc, 1)
     else:
         unicode_url = decoded_string
     return unicode_url
 
 
+def _idna_netloc(netloc):
+    """ Netloc converted via IDNA, or as is if conversion fails.
+    Conversion of non-ASCII netlocs is slow, so it is cached.
+    """
+    cached = not netloc.isascii()
+    idna_netloc = _IDNA_NETLOCS.get(netloc, _UNSET) if cached else _UNSET
+    if idna_netloc is _UNSET:
+        try:
+            idna_netloc = netloc.encode("idna").decode()
+        except:
+            idna_netloc = ''
+        if cached:
+            _IDNA_NETLOCS.set(netloc, idna_netloc)
+    if not idna_netloc:
+        _count_event('idna_failure')
+        return netloc
+    return idna_netloc
+
+
+class ParsedURL(object):
+    """ URL parsed once, with every derived part computed lazily and cached.
+
+    Any function of this module accepts ParsedURL instead of a string,
+    so a chain of calls on the same URL parses and validates it only once.
+    """
+
+    __slots__ = ('url', '_decoded', '_parsed', '_valid', '_loose_netloc',
+                 '_zone')
+
+    def __init__(self, url):
+        self.url = url
+        self._decoded = _UNSET
+        self._parsed = _UNSET
+        self._valid = _UNSET
+        self._loose_netloc = _UNSET
+        self._zone = _UNSET
+
+    def __repr__(self):
+        return 'ParsedURL(%r)' % (self.url,)
+
+    @property
+    def decoded(self):
+        """ URL decoded to UNICODE with IDNA-encoded netloc """
+        if self._decoded is _UNSET:
+            self._decoded = decode_url(self.url)
+        return self._decoded
+
+    @property
+    def parsed(self):
+        """ urllib.parse.urlparse result for the original URL """
+        if self._parsed is _UNSET:
+            self._parsed = urllib.parse.urlparse(self.url)
+        return self._parsed
+
+    @property
+    def netloc(self):
+        return self.parsed.netloc
+
+    @property
+    def host(self):
+        return self.parsed.hostname
+
+    @property
+    def port(self):
+        try:
+            return self.parsed.port
+        except ValueError:
+            return None
+
+    @property
+    def path(self):
+        return self.parsed.path
+
+    @property
+    def query(self):
+        return self.parsed.query
+
+    @property
+    def is_valid(self):
+        """ Same as is_string_url for the original URL """
+        if self._valid is _UNSET:
+            self._valid = _memoize('is_string_url', self.url,
+                                   _is_parsed_url_valid, self)
+        return self._valid
+
+    @property
+    def loose_netloc(self):
+        """ Netloc, or first path part for URLs without protocol """
+        if self._loose_netloc is _UNSET:
+            netloc = self.parsed.netloc
+            if not netloc:
+                netloc = self.parsed.path.split('/')[0]
+            self._loose_netloc = netloc
+        return self._loose_netloc
+
+    @property
+    def zone(self):
+        """ Same as get_domain_zone for the original URL """
+        if self._zone is _UNSET:
+            netloc = self.loose_netloc
+            self._zone = _memoize('get_domain_zone', netloc,
+                                  _netloc_zone, netloc)
+        return self._zone
+
+
+def _loose_netloc(url):
+    """ ParsedURL.loose_netloc, plain domains and simple URLs are split
+    without urlparse
+    """
+    if isinstance(url, str):
+        if _PLAIN_HOST_REGEX.match(url):
+            return url
+        match = _URL_NETLOC_REGEX.match(url)
+        if match is not None and match.group(1)[:1] > ' ':
+            return match.group(1)
+    return parse_url(url).loose_netloc
+
+
+def _bytes_string(data):
+    """ str of bytes-like data, ASCII is decoded without any guessing
+    """
+    data = bytes(data)
+    if data.isascii():
+        return data.decode('ascii')
+    return decode_string(data)
+
+
+def _is_ascii_url_valid(url):
+    """ Not memoized is_string_url for ASCII string, it needs no decoding
+    """
+    is_valid = is_url_syntax_valid(url)
+    if not is_valid and _INSTRUMENTATION is not None:
+        _count_event('url_rejected')
+    return is_valid
+
+
+def _is_parsed_url_valid(parsed):
+    """ Not memoized is_string_url for ParsedURL
+    """
+    try:
+        decoded = parsed.decoded
+    except ValueError:
+        # urlparse rejects unbalanced IPv6 brackets
+        return False
+    is_valid = is_url_syntax_valid(decoded)
+    if not is_valid and _INSTRUMENTATION is not None:
+        _count_event('url_rejected')
+    return is_valid
+
+
+def parse_url(url):
+    """ Build ParsedURL from string, or return ParsedURL as is
+
+    :param url: URL string or ParsedURL
+    :returns: ParsedURL instance
+    """
+    if isinstance(url, ParsedURL):
+        return url
+    return ParsedURL(url)
+
+
+def _url_string(url):
+    """ Original URL string from string or ParsedURL
+    """
+    if isinstance(url, ParsedURL):
+        return url.url
+    return url
+
+
 def is_url_or_domain_valid(url):
     """ Check if URL or DOMAIN is valid
 
     :param url: URL or Domain string
     :returns: Boolean True or False
     """
-    # Create URL validation FAILURE marker
-    is_url_invalid = (not is_string_url(url) and
-                      not is_string_domain(url))
-    if is_url_invalid:
-        return False
-    return True
+    return classify_host(url) in (HOST_URL, HOST_DOMAIN, HOST_LOCALHOST)
 
 
 def urlencode_string(string):
@@ -99,6 +878,7 @@ def urlencode_string(string):
     :param string: Any string to be encoded
     :returns: urlencoded ascii string
     """
+    string = _url_string(string)
     return urllib.parse.quote(string.encode('utf-8'), '')
 
 
@@ -108,6 +888,7 @@ def remove_http(url):
     :param url: Something like URL
     :returns: url without http(s)://
     """
+    url = _url_string(url)
     url = url.replace('https://', '', 1)
     url = url.replace('http://', '', 1)
     return url
@@ -119,6 +900,7 @@ def remove_last_slash(string):
     :param string: URL or any string
     :returns: string without slashes at the end
     """
+    string = _url_string(string)
     while True:
         if string[-1:] != '/':
             break
@@ -132,6 +914,7 @@ def remove_www(url):
     :param url: Something like URL
     :returns: URL without www
     """
+    url = _url_string(url)
     try:
         url = ''.join(REMOVE_WWW_PATTERN.findall(url)[0])
     except IndexError:
@@ -145,11 +928,7 @@ def full_clean_url(url):
     :param url: Something like URL
     :returns: Dramatically cleared URL
     """
-    url = url.strip()
-    url = remove_http(url)
-    url = remove_last_slash(url)
-    url = remove_www(url)
-    return url
+    return _FULL_CLEAN_NORMALIZER.normalize(url)
 
 
 def clear_http_and_last_slash(string):
@@ -158,12 +937,170 @@ def clear_http_and_last_slash(string):
     :param string: Something like URL
     :returns: Cleared URL
     """
-    url = string
+    url = _url_string(string)
     url = remove_http(url)
     url = remove_last_slash(url)
     return url
 
 
+class URLNormalizer(object):
+    """ URL normalizer compiled from a set of steps
+
+    Steps run in the order of NORMALIZE_STEPS whatever order they are
+    given in. Only the code of enabled steps runs for every URL. Steps of
+    full_clean_url work on the whole string with a few C-level str calls,
+    NORMALIZE_FRAGMENT, NORMALIZE_PORT and NORMALIZE_LOWER_HOST make the
+    URL be matched once against a regex cutting it into scheme, netloc,
+    path and fragment, which are joined back in the end.
+
+    NORMALIZE_SCHEME, NORMALIZE_SLASH and NORMALIZE_WWW give the same
+    output as remove_http, remove_last_slash and remove_www, and
+    FULL_CLEAN_STEPS the same as the chain of them full_clean_url was.
+    Strings with '://' after the leading scheme go through remove_http
+    first to keep its output.
+
+    NORMALIZE_PORT drops :80 of http and :443 of https URLs, URLs without
+    scheme count as http. NORMALIZE_LOWER_HOST lowercases netloc but user
+    info in it.
+    """
+
+    def __init__(self, steps=FULL_CLEAN_STEPS):
+        """ Compile normalizer
+
+        :param steps: Iterable of NORMALIZE_* steps
+        """
+        steps = set(steps)
+        unknown = steps.difference(NORMALIZE_STEPS)
+        if unknown:
+            raise ValueError(
+                'Unknown normalize steps: %s' % ', '.join(sorted(unknown)))
+        self.steps = tuple(step for step in NORMALIZE_STEPS if step in steps)
+        self._strip = NORMALIZE_STRIP in steps
+        self._scheme = NORMALIZE_SCHEME in steps
+        self._fragment = NORMALIZE_FRAGMENT in steps
+        self._port = NORMALIZE_PORT in steps
+        self._lower_host = NORMALIZE_LOWER_HOST in steps
+        self._slash = NORMALIZE_SLASH in steps
+        self._www = NORMALIZE_WWW in steps
+        if self._fragment or self._port or self._lower_host:
+            self._run = self._normalize_parts
+        else:
+            self._run = self._normalize_string
+
+    def __repr__(self):
+        return 'URLNormalizer(%r)' % (self.steps,)
+
+    def normalize(self, url):
+        """ Normalize one URL
+
+        :param url: Something like URL
+        :returns: Normalized URL string
+        """
+        url = _url_string(url)
+        if self._strip:
+            url = url.strip()
+        return self._run(url, self._scheme)
+
+    def normalize_many(self, urls):
+        """ Normalize every URL of iterable
+
+        :param urls: Iterable of URL strings
+        :returns: list of normalized URLs in the order of urls
+        """
+        run = self._run
+        drop_scheme = self._scheme
+        if self._strip:
+            return [run(_url_string(url).strip(), drop_scheme)
+                    for url in urls]
+        return [run(_url_string(url), drop_scheme) for url in urls]
+
+    def _normalize_string(self, url, drop_scheme):
+        """ Steps working on the whole string, no need to cut it to parts
+        """
+        if url.startswith('https://'):
+            start = 8
+        elif url.startswith('http://'):
+            start = 7
+        else:
+            start = 0
+        if drop_scheme:
+            # remove_http drops first http(s):// found anywhere in string
+            if url.find('://', start) != -1:
+                return self._normalize_string(remove_http(url), False)
+            url = url[start:]
+            start = 0
+        if self._slash:
+            url = url.rstrip('/')
+        if self._www and url.startswith('www.', start):
+            url = _remove_www_at(url, start)
+        return url
+
+    def _normalize_parts(self, url, drop_scheme):
+        """ Steps working on scheme, netloc, path and fragment of URL
+        """
+        scheme, netloc, path, fragment = (
+            _NORMALIZE_URL_REGEX.match(url).groups())
+        if drop_scheme:
+            # remove_http drops first http(s):// found anywhere in string
+            if scheme is None or (scheme not in _HTTP_SCHEMES and
+                                  'http' in scheme):
+                start = 0
+            else:
+                start = len(scheme) + 3
+            if url.find('://', start) != -1:
+                return self._normalize_parts(remove_http(url), False)
+
+        if fragment is not None and not self._fragment:
+            path += fragment
+        if self._port:
+            # Schemes are case-insensitive, unlike remove_http
+            port = _DEFAULT_PORTS.get(scheme and scheme.lower())
+            if port is not None and netloc.endswith(port):
+                netloc = netloc[:-len(port)]
+        if self._lower_host:
+            user, at, host = netloc.rpartition('@')
+            netloc = user + at + host.lower()
+
+        if scheme is None or drop_scheme and scheme in _HTTP_SCHEMES:
+            prefix = ''
+        else:
+            prefix = scheme + '://'
+        url = prefix + netloc + path
+        if self._slash:
+            url = url.rstrip('/')
+        if self._www:
+            start = len(prefix) if scheme in _HTTP_SCHEMES else 0
+            if url.startswith('www.', start):
+                url = _remove_www_at(url, start)
+        return url
+
+
+def _remove_www_at(url, start):
+    """ Remove www. found at start of url like remove_www does
+    """
+    tail = url[start + 4:]
+    if '\n' in tail:
+        # .+ of REMOVE_WWW_PATTERN stops at first line break
+        tail = tail.partition('\n')[0]
+    if not tail:
+        return url
+    return url[:start] + tail
+
+
+# Normalizer behind full_clean_url
+_FULL_CLEAN_NORMALIZER = URLNormalizer(FULL_CLEAN_STEPS)
+
+
+def normalize_many(urls, steps=FULL_CLEAN_STEPS):
+    """ Normalize every URL of iterable with one URLNormalizer
+
+    :param urls: Iterable of URL strings
+    :param steps: Iterable of NORMALIZE_* steps, full_clean_url by default
+    :returns: list of normalized URLs in the order of urls
+    """
+    return URLNormalizer(steps).normalize_many(urls)
+
+
 def is_link_internal(link, domain):
     """ Check is link internal for domain
 
@@ -172,12 +1109,15 @@ def is_link_internal(link, domain):
     :returns: Boolean True or False
     """
     relativity = True
-    url = link.strip()
-    if is_string_url(url):
+    url = parse_url(link)
+    if url.url != url.url.strip():
+        url = ParsedURL(url.url.strip())
+    if url.is_valid:
         try:
             clean_url = full_clean_url(url)
-            if is_string_url(domain):
-                domain = get_url_domain(domain)
+            domain = parse_url(domain)
+            if domain.is_valid:
+                domain = domain.netloc
             clean_domain = full_clean_url(domain)
 
             pos = clean_url.index(clean_domain)
@@ -189,16 +1129,80 @@ def is_link_internal(link, domain):
     return relativity
 
 
+def classify_links(links, page_url):
+    """ Classify all links found on page in one pass
+
+    Page URL is parsed and cleaned once for all links. Absolute links are
+    internal or external in terms of is_link_internal, relative links
+    are resolved against page URL.
+
+    :param links: Iterable of URLs/URIs found on page
+    :param page_url: Regular valid URL of page
+    :returns: list of (kind, url) tuples, where kind is one of LINK_INTERNAL,
+        LINK_EXTERNAL, LINK_RELATIVE, LINK_INVALID and url is absolute URL
+        or stripped link if it is invalid
+    """
+    resolve = URLResolver(page_url).resolve
+    page_url = parse_url(page_url)
+    clean_domain = full_clean_url(page_url.netloc)
+    # Resolved links starting with valid page origin need only the
+    # rest of URL to be checked
+    origin = '%s://%s' % (page_url.parsed.scheme, page_url.netloc)
+
+    classified = []
+    for link in links:
+        link = _url_string(link).strip()
+        try:
+            kind, url = _classify_link(link, resolve, origin, clean_domain)
+        except ValueError:
+            # urlparse rejects links like http://[x/ with bad IPv6 host
+            kind, url = LINK_INVALID, link
+        classified.append((kind, url))
+    return classified
+
+
+def _classify_link(link, resolve, origin, clean_domain):
+    """ (kind, url) of stripped link for classify_links
+    """
+    if is_string_url(link):
+        url = link
+    else:
+        url = resolve(link)
+        if url.startswith(origin) and url[len(origin):][:1] in '/?':
+            is_valid = URL_TAIL_REGEX.match(url, len(origin)) is not None
+        else:
+            is_valid = is_string_url(url)
+        if not is_valid:
+            return LINK_INVALID, link
+        # Network-path reference (//host/path) may lead to other host
+        if not link.startswith('//'):
+            return LINK_RELATIVE, url
+    if full_clean_url(url).startswith(clean_domain):
+        return LINK_INTERNAL, url
+    return LINK_EXTERNAL, url
+
+
 def get_url_domain(url):
     """ Get domain from URL
 
-    :param url: Regular valid URL
-    :returns: domain or raises ValueError
+    ASCII URLs, as str or bytes-like, are checked and split without
+    decoding, urlparse and IDNA encoding, which change nothing in them.
+
+    :param url: Regular valid URL, str, bytes, bytearray or memoryview
+    :returns: domain str or raises ValueError
     """
-    if not is_string_url(url):
-        raise ValueError("Not valid URL: %s" % url)
-    domain =  urllib.parse.urlparse(url).netloc
-    return domain
+    if isinstance(url, _BYTES_TYPES):
+        url = _bytes_string(url)
+    if isinstance(url, str) and url.isascii():
+        if not _memoize('is_string_url', url, _is_ascii_url_valid, url):
+            raise ValueError("Not valid URL: %s" % url)
+        match = _URL_NETLOC_REGEX.match(url)
+        if match is not None and match.group(1)[:1] > ' ':
+            return match.group(1)
+    url = parse_url(url)
+    if not url.is_valid:
+        raise ValueError("Not valid URL: %s" % url.url)
+    return url.netloc
 
 
 def make_absolute_url(relative, baseurl):
@@ -208,27 +1212,126 @@ def make_absolute_url(relative, baseurl):
     :param baseurl: Base parent absolute URL
     :returns: Absolute URL or raises ValueError
     """
-    if not is_string_url(baseurl):
-        raise ValueError('Not valid URL %s' % baseurl)
-    absolute_url = urllib.parse.urljoin(baseurl, relative)
+    baseurl = parse_url(baseurl)
+    if not baseurl.is_valid:
+        raise ValueError('Not valid URL %s' % baseurl.url)
+    absolute_url = urllib.parse.urljoin(baseurl.url, _url_string(relative))
     return absolute_url
 
 
+def make_absolute_urls(relatives, baseurl):
+    """ Makes ABS URLs from many URLs/URIs and one base URL
+
+    :param relatives: Iterable of relative URIs or URLs
+    :param baseurl: Base parent absolute URL
+    :returns: list of absolute URLs or raises ValueError
+    """
+    return URLResolver(baseurl).resolve_many(relatives)
+
+
+class URLResolver(object):
+    """ Resolver of relative URIs against base URL parsed and validated once.
+
+    Gives the same result as make_absolute_url (urllib.parse.urljoin).
+    Fragments, queries and absolute URLs are resolved without urljoin.
+    """
+
+    def __init__(self, baseurl):
+        baseurl = parse_url(baseurl)
+        if not baseurl.is_valid:
+            raise ValueError('Not valid URL %s' % baseurl.url)
+        self.baseurl = baseurl
+        scheme, netloc, path, params, query, _ = urllib.parse.urlparse(
+            baseurl.url, '')
+        self._scheme = scheme
+        self._is_relative = scheme in urllib.parse.uses_relative
+        self._path_prefix = urllib.parse.urlunparse(
+            (scheme, netloc, path, params, '', ''))
+        self._query_prefix = urllib.parse.urlunparse(
+            (scheme, netloc, path, params, query, ''))
+
+    def resolve(self, relative):
+        """ Makes ABS URL from relative URI or URL
+
+        :param relative: Current relative URI or URL
+        :returns: Absolute URL
+        """
+        relative = _url_string(relative)
+        if not relative:
+            return self.baseurl.url
+
+        # urlparse strips leading control chars, drops tabs and newlines
+        # and checks IPV6 brackets, such links take the generic way
+        first = relative[0]
+        for char in '\n\t\r[]':
+            if char in relative:
+                first = ''
+                break
+        if first <= ' ':
+            return urllib.parse.urljoin(self.baseurl.url, relative)
+        if not self._is_relative:
+            # urljoin does not resolve anything for such schemes
+            return relative
+
+        if first == '#':
+            if relative == '#':
+                return self._query_prefix
+            return self._query_prefix + relative
+        if first == '?':
+            query, _, fragment = relative[1:].partition('#')
+            if not query:
+                url = self._query_prefix
+            else:
+                url = self._path_prefix + '?' + query
+            if fragment:
+                url += '#' + fragment
+            return url
+
+        scheme = _url_scheme(relative)
+        if scheme and scheme != self._scheme:
+            return relative
+        if relative[len(scheme) + bool(scheme):][:2] == '//':
+            parts = urllib.parse.urlparse(relative, self._scheme)
+            if parts.netloc:
+                # Absolute URL or network-path reference, base is not used
+                return urllib.parse.urlunparse(parts)
+        return urllib.parse.urljoin(self.baseurl.url, relative)
+
+    def resolve_many(self, relatives):
+        """ Makes ABS URLs from iterable of relative URIs or URLs
+
+        :param relatives: Iterable of relative URIs or URLs
+        :returns: list of absolute URLs
+        """
+        resolve = self.resolve
+        return [resolve(relative) for relative in relatives]
+
+
+def _url_scheme(url):
+    """ Lowercase scheme of URL as urllib.parse finds it, or empty string
+    """
+    pos = url.find(':')
+    if pos > 0 and url[0].isascii() and url[0].isalpha():
+        if not url[:pos].strip(urllib.parse.scheme_chars):
+            return url[:pos].lower()
+    return ''
+
+
 def is_url_domain(url):
     """ Checks is URL domain
 
     :param url: Regular URL
     :returns: Boolean True or False
     """
-    if not is_string_url(url):
+    url = parse_url(url)
+    if not url.is_valid:
         return False
 
-    parsed_url = urllib.parse.urlparse(url)
-    if not is_string_domain(parsed_url.netloc):
+    if not is_string_domain(url.netloc):
         return False
 
-    is_domain_path_valid = (parsed_url.path == '' or parsed_url.path == '/')
-    if is_domain_path_valid and not parsed_url.query:
+    is_domain_path_valid = (url.path == '' or url.path == '/')
+    if is_domain_path_valid and not url.query:
         return True
     return False
 
@@ -240,45 +1343,218 @@ def split_url(url, clean_domain=True):
     :param clean_domain: Bool flag to clean www in domain
     :returns: (domain, uri) tuple or raises ValueError
     """
-    if not is_string_url(url):
-        raise ValueError('Can not split invalid URL: %s' % url)
-
-    domain = get_url_domain(url)
+    splitted_url = _split_url(url)
+    if splitted_url is None:
+        raise ValueError('Can not split invalid URL: %s' % _url_string(url))
     if clean_domain:
-        domain = remove_www(domain)
-    uri = url.split(domain)[-1]
-    splitted_url = (domain, uri)
+        splitted_url = (remove_www(splitted_url[0]), splitted_url[1])
     return splitted_url
 
 
-def is_string_ipv4(string):
-    """ Check is string valid IPV4
+def split_urls(urls, clean_domain=True, invalid=_UNSET):
+    """ split_url of every URL, as parallel domain and URI columns
 
-    :param string: IPV4 string
-    :returns: Boolean True or False
+    Every URL is validated and cut at the end of its netloc once,
+    ASCII URLs without urlparse. www is cleaned once per netloc.
+
+    :param urls: Iterable of URL strings or ParsedURL
+    :param clean_domain: Bool flag to clean www in domains
+    :param invalid: Domain and URI of invalid URLs, raises ValueError
+                    by default
+    :returns: (domains, uris) tuple of lists in the order of urls
+    """
+    domains = []
+    uris = []
+    clean_domains = {}
+    for url in urls:
+        splitted_url = _split_url(url)
+        if splitted_url is None:
+            if invalid is _UNSET:
+                raise ValueError(
+                    'Can not split invalid URL: %s' % _url_string(url))
+            domains.append(invalid)
+            uris.append(invalid)
+            continue
+        domain, uri = splitted_url
+        if clean_domain:
+            cleaned = clean_domains.get(domain)
+            if cleaned is None:
+                cleaned = clean_domains[domain] = remove_www(domain)
+            domain = cleaned
+        domains.append(domain)
+        uris.append(uri)
+    return domains, uris
+
+
+def _split_url(url):
+    """ (netloc, uri) of valid URL or None, uri is the text after netloc
+    """
+    if isinstance(url, str) and url.isascii():
+        if not _memoize('is_string_url', url, _is_ascii_url_valid, url):
+            return None
+        match = _URL_NETLOC_REGEX.match(url)
+        if match is not None and match.group(1)[:1] > ' ':
+            return match.group(1), url[match.end(1):]
+    url = parse_url(url)
+    if not url.is_valid:
+        return None
+    netloc = url.netloc
+    string = url.url
+    start = string.find('//') + 2
+    if not string.startswith(netloc, start):
+        raise ValueError('Can not find netloc of URL: %s' % string)
+    return netloc, string[start + len(netloc):]
+
+
+def classify_host(string):
+    """ Tell what kind of URL or host string is, in a single pass
+
+    Only strings with protocol in the first 8 chars can be URLs,
+    so URL and host checks never run both.
+
+    :param string: URL or host str, bytes, bytearray or memoryview
+    :returns: HOST_URL, HOST_DOMAIN, HOST_IPV4, HOST_IPV6 (plain
+        or in brackets), HOST_LOCALHOST or HOST_INVALID
+    """
+    text = _url_string(string)
+    if isinstance(text, _BYTES_TYPES):
+        text = _bytes_string(text)
+        if not isinstance(string, ParsedURL):
+            string = text
+    if text.find('://', 0, 8) >= 0:
+        return HOST_URL if is_string_url(string) else HOST_INVALID
+    return (_memoize('is_string_domain', text, _classify_bare_host, text) or
+            HOST_INVALID)
+
+
+def _classify_bare_host(string):
+    """ classify_host of string without protocol, None if it is invalid
     """
-    if not IPV4_REGEX.search(string):
+    decoded_string = decode_string(string)
+    if not decoded_string:
+        return None
+
+    if decoded_string[0] == '[' and decoded_string[-1] == ']':
+        return HOST_IPV6 if _is_ipv6(decoded_string[1:-1]) else None
+    if ':' in decoded_string:
+        return HOST_IPV6 if _is_ipv6(decoded_string) else None
+
+    if (len(decoded_string) == 9 and
+            decoded_string.replace('\u017f', 's').lower() == 'localhost'):
+        return HOST_LOCALHOST
+
+    if _IPV4_OCTETS_REGEX.match(decoded_string) is not None:
+        return HOST_IPV4
+
+    try:
+        # If last domain part is integer - it is not domain
+        int(decoded_string.rpartition('.')[2])
+        return None
+    except ValueError:
+        pass
+
+    if not DOMAIN_REGEX.search(decoded_string):
+        if _INSTRUMENTATION is not None:
+            _count_event('domain_rejected')
+        return None
+    return HOST_DOMAIN
+
+
+def _is_ipv6(string):
+    """ Check is string IPv6 address, zone index allowed
+    """
+    import ipaddress
+    try:
+        ipaddress.IPv6Address(string)
+    except ValueError:
         return False
     return True
 
 
+def is_string_ipv4(string):
+    """ Check is string valid IPV4, every octet is a number up to 255
+
+    :param string: IPV4 str, bytes, bytearray or memoryview
+    :returns: Boolean True or False
+    """
+    string = _url_string(string)
+    if isinstance(string, _BYTES_TYPES):
+        string = _bytes_string(string)
+    return _IPV4_OCTETS_REGEX.match(string) is not None
+
+
 def is_string_domain(string):
     """ Check is string valid domain
 
-    :param string: Domain string
+    URLs are rejected by their protocol, without validation.
+
+    :param string: Domain str, bytes, bytearray or memoryview
     :returns: Boolean True or False
     """
-    decoded_string = decode_string(string)
+    string = _url_string(string)
+    if isinstance(string, _BYTES_TYPES):
+        string = _bytes_string(string)
+    if string.find('://', 0, 8) >= 0:
+        return False
+    return _memoize('is_string_domain', string, _classify_bare_host,
+                    string) in (HOST_DOMAIN, HOST_LOCALHOST)
 
-    try:
-        # If last domain part is integer - it is not domain
-        int(decoded_string.split('.')[-1])
+
+def is_url_syntax_valid(string, max_length=_UNSET):
+    """ Linear time equivalent of DJANGO_URL_REGEX.search(string)
+
+    Hostile hostnames can make the regex backtrack for seconds,
+    this check does a fixed number of passes over the string.
+
+    :param string: Decoded URL string or ParsedURL, see decode_url
+    :param max_length: Longer strings are invalid, MAX_URL_LENGTH by default
+    :returns: Boolean True or False
+    """
+    string = _url_string(string)
+    if max_length is _UNSET:
+        max_length = MAX_URL_LENGTH
+    if max_length is not None and len(string) > max_length:
         return False
-    except ValueError:
-        pass
 
-    if not DOMAIN_REGEX.search(decoded_string):
+    # Cheap rejection of anything without protocol
+    if string.find('://', 0, 8) < 0:
+        return False
+
+    # Host is the longest run of host chars, so nothing to backtrack
+    match = URL_HOST_REGEX.match(string)
+    if match is None:
+        return False
+    if URL_TAIL_REGEX.match(string, match.end()) is None:
+        return False
+    return _is_url_host_valid(match.group(1))
+
+
+def _is_url_host_valid(host):
+    """ Host part of DJANGO_URL_REGEX: domain, localhost or IPV4
+
+    :param host: Non-empty run of regex \\w chars, dots and hyphens
+    """
+    if host.count('.') == 3 and host[-1].isdecimal():
+        octets = host.split('.')
+        if (host.replace('.', '').isdecimal() and
+                0 < min(map(len, octets)) and max(map(len, octets)) < 4):
+            return True
+    if len(host) == 9 and host.replace('\u017f', 's').lower() == 'localhost':
+        return True
+
+    # Domain zone may end with a single dot
+    if host[-1] == '.':
+        host = host[:-1]
+    domain, _, zone = host.rpartition('.')
+    if not domain or len(zone) < 2:
+        return False
+    labels = domain.split('.')
+    if '' in labels or max(map(len, labels)) > 63:
         return False
+    if '-' in domain:
+        # Labels can not start or end with hyphen
+        domain = '.%s.' % domain
+        return '.-' not in domain and '-.' not in domain
     return True
 
 
@@ -288,10 +1564,7 @@ def is_string_url(url):
     :param string: Something to check is it URL
     :returns: boolean True or False
     """
-    decoded_url = decode_url(url)
-    if not DJANGO_URL_REGEX.search(decoded_url):
-        return False
-    return True
+    return parse_url(url).is_valid
 
 
 def toggle_last_url_slash(url, encoded=False):
@@ -301,7 +1574,7 @@ def toggle_last_url_slash(url, encoded=False):
     :param encoded: Boolean flag of URL presentation
     :returns: URL with toggled last slash
     """
-    trimmed_url = url.strip()
+    trimmed_url = _url_string(url).strip()
     if encoded:
         slash = "%2F"
     else:
@@ -321,11 +1594,8 @@ def toggle_url_www(url):
     :returns: String with toggled www domain
     """
     # Get domain from URL
-    parsed_url = urllib.parse.urlparse(url)
-    if parsed_url.netloc:
-        netloc = parsed_url.netloc
-    else:
-        netloc = parsed_url.path.split('/')[0]
+    url = parse_url(url)
+    netloc = url.loose_netloc
 
     # Toggle www
     if netloc.lower().startswith('www.'):
@@ -333,21 +1603,19 @@ def toggle_url_www(url):
     else:
         toggled_netloc = 'www.' + netloc
     # Replace first occurrence of domain in original string
-    toggled_url = url.replace(netloc, toggled_netloc, 1)
+    toggled_url = url.url.replace(netloc, toggled_netloc, 1)
     return toggled_url
 
 
 def get_root_domain_zone(url):
     """ Get ROOT Domain Zone (last word after last dot)
 
-    :param url: Any kind or URL or domain string
+    :param url: Any kind or URL or domain str, bytes, bytearray or memoryview
     :returns: Root domain zone
     """
-    parsed_url = urllib.parse.urlparse(url)
-    if parsed_url.netloc:
-        netloc = parsed_url.netloc
-    else:
-        netloc = parsed_url.path.split('/')[0]
+    if isinstance(url, _BYTES_TYPES):
+        url = _bytes_string(url)
+    netloc = _loose_netloc(url)
     splitted = netloc.split('.')
     root_domain_zone = splitted[-1]
     return root_domain_zone
@@ -355,18 +1623,17 @@ def get_root_domain_zone(url):
 
 def get_domain_zone(url):
     """ Not so accurate but efficient way to get domain zone from URL string.
+    See get_public_suffix for zone by Public Suffix List rules.
 
     :param url: Any kind or URL or domain string
     :returns: domain zone string
     """
-    # Get domain from string
-    parsed_url = urllib.parse.urlparse(url)
-    if parsed_url.netloc:
-        netloc = parsed_url.netloc
-    else:
-        netloc = parsed_url.path.split('/')[0]
+    return parse_url(url).zone
+
 
-    # Get domain zone from domain
+def _netloc_zone(netloc):
+    """ Domain zone of netloc, see get_domain_zone
+    """
     domain_zone = list()
     splitted = netloc.split('.')
     domain_zone.append(splitted[-1])
@@ -380,18 +1647,573 @@ def get_domain_zone(url):
     return dz
 
 
+def _map_saved_file(path, header, magic, error):
+    """ Read-only mmap of file starting with struct header and its fields
+    after magic, raises ValueError(error) with nothing left open if the
+    file is too short or magic does not match
+    """
+    with open(path, 'rb') as saved_file:
+        mapped = mmap.mmap(saved_file.fileno(), 0, access=mmap.ACCESS_READ)
+    if len(mapped) >= struct.calcsize(header):
+        fields = struct.unpack_from(header, mapped)
+        if fields[0] == magic:
+            return mapped, fields[1:]
+    mapped.close()
+    raise ValueError(error)
+
+
+class PublicSuffixList(object):
+    """ Public Suffix List compiled into a trie of reversed domain labels.
+
+    The trie lives in three flat buffers (nodes, edges, label bytes),
+    which are either built from the list text or memory-mapped from
+    a file written by save(), so loading it costs no parsing at all.
+    """
+
+    def __init__(self, nodes, edges, labels, mapped=None):
+        self._nodes = nodes
+        self._edges = edges
+        self._labels = labels
+        self._mapped = mapped
+        # Hash index of visited nodes, see _children
+        self._index = {}
+
+    @classmethod
+    def parse(cls, text):
+        """ Compile list from Public Suffix List text
+
+        :param text: PSL file content
+        :returns: PublicSuffixList instance
+        """
+        root = {}
+        flags = {}
+        for line in text.splitlines():
+            line = line.strip()
+            if not line or line.startswith('//'):
+                continue
+            rule = line.split()[0].lower()
+            flag = _PSL_RULE
+            if rule.startswith('!'):
+                rule, flag = rule[1:], _PSL_EXCEPTION
+            node = root
+            for label in reversed(rule.split('.')):
+                node = node.setdefault(label.encode('utf-8'), {})
+            flags[id(node)] = flags.get(id(node), 0) | flag
+
+        # Flatten breadth-first, children of every node sorted by label
+        nodes = array.array('I')
+        edges = array.array('I')
+        labels = bytearray()
+        queue = collections.deque([root])
+        next_index = 1
+        while queue:
+            node = queue.popleft()
+            nodes.extend((len(edges) // 3, len(node), flags.get(id(node), 0)))
+            for label in sorted(node):
+                edges.extend((len(labels), len(label), next_index))
+                labels.extend(label)
+                queue.append(node[label])
+                next_index += 1
+        return cls(nodes, edges, bytes(labels))
+
+    @classmethod
+    def from_file(cls, path=None):
+        """ Compile list from Public Suffix List text file
+
+        :param path: PSL file path, bundled PSL_FILE by default
+        :returns: PublicSuffixList instance
+        """
+        with open(path or PSL_FILE, encoding='utf-8') as psl_file:
+            return cls.parse(psl_file.read())
+
+    @classmethod
+    def load(cls, path):
+        """ Memory-map list compiled by save()
+
+        :param path: Compiled list file path
+        :returns: PublicSuffixList instance or raises ValueError
+        """
+        error = 'Not compiled Public Suffix List: %s' % path
+        mapped, (nodes_count, edges_count, labels_size) = _map_saved_file(
+            path, _PSL_HEADER, _PSL_MAGIC, error)
+        nodes_start = struct.calcsize(_PSL_HEADER)
+        edges_start = nodes_start + nodes_count * 12
+        labels_start = edges_start + edges_count * 12
+        if len(mapped) < labels_start + labels_size:
+            mapped.close()
+            raise ValueError(error)
+        buffer = memoryview(mapped)
+        nodes = buffer[nodes_start:edges_start].cast('I')
+        edges = buffer[edges_start:labels_start].cast('I')
+        labels = buffer[labels_start:labels_start + labels_size]
+        if sys.byteorder != 'little':
+            # Columns are saved little-endian, big-endian hosts swap a copy
+            nodes = array.array('I', nodes)
+            edges = array.array('I', edges)
+            nodes.byteswap()
+            edges.byteswap()
+        return cls(nodes, edges, labels, mapped)
+
+    def save(self, path):
+        """ Write compiled list to file for load()
+
+        :param path: Compiled list file path
+        """
+        nodes = array.array('I', self._nodes)
+        edges = array.array('I', self._edges)
+        if sys.byteorder != 'little':
+            nodes.byteswap()
+            edges.byteswap()
+        with open(path, 'wb') as psl_file:
+            psl_file.write(struct.pack(
+                _PSL_HEADER, _PSL_MAGIC, len(nodes) // 3, len(edges) // 3,
+                len(self._labels)))
+            psl_file.write(nodes.tobytes())
+            psl_file.write(edges.tobytes())
+            psl_file.write(bytes(self._labels))
+
+    def close(self):
+        """ Release memory-mapped file of list loaded by load()
+        """
+        if self._mapped is not None:
+            self._nodes = self._edges = self._labels = None
+            self._index = {}
+            self._mapped.close()
+            self._mapped = None
+
+    def _children(self, node):
+        """ Dict of child nodes by label, built on first visit of node
+        """
+        children = self._index.get(node)
+        if children is None:
+            edges = self._edges
+            labels = self._labels
+            first = self._nodes[node * 3] * 3
+            last = first + self._nodes[node * 3 + 1] * 3
+            children = {}
+            for edge in range(first, last, 3):
+                offset = edges[edge]
+                label = bytes(labels[offset:offset + edges[edge + 1]])
+                children[label.decode('utf-8')] = edges[edge + 2]
+            self._index[node] = children
+        return children
+
+    def suffix_size(self, labels):
+        """ Number of labels in public suffix of domain
+
+        :param labels: Lowercase UNICODE labels of domain
+        :returns: Number of labels, at least 1 by the implicit `*` rule
+        """
+        nodes = self._nodes
+        size = 1
+        node = 0
+        for depth, label in enumerate(reversed(labels)):
+            children = self._children(node)
+            wildcard = children.get('*')
+            if wildcard is not None and nodes[wildcard * 3 + 2] & _PSL_RULE:
+                size = max(size, depth + 1)
+            node = children.get(label)
+            if node is None:
+                break
+            flags = nodes[node * 3 + 2]
+            if flags & _PSL_EXCEPTION:
+                # Exception rule wins, its leftmost label is not suffix
+                return depth
+            if flags & _PSL_RULE:
+                size = max(size, depth + 1)
+        return size
+
+
+def get_public_suffix(url, psl=None):
+    """ Get public suffix (effective TLD) of URL or domain by PSL rules
+
+    :param url: Any kind of URL or domain string
+    :param psl: PublicSuffixList, bundled list by default
+    :returns: public suffix string or None for empty host
+    """
+    labels, size = _public_suffix_split(url, psl)
+    if not size:
+        return None
+    return '.'.join(labels[-size:])
+
+
+def get_registrable_domain(url, psl=None):
+    """ Get registrable domain (public suffix and one more label)
+
+    :param url: Any kind of URL or domain string
+    :param psl: PublicSuffixList, bundled list by default
+    :returns: registrable domain or None if host is a public suffix
+    """
+    labels, size = _public_suffix_split(url, psl)
+    if not size or len(labels) <= size:
+        return None
+    return '.'.join(labels[-size - 1:])
+
+
+def set_public_suffix_list(psl):
+    """ Replace list used by default, e.g. with PublicSuffixList.load()
+
+    :param psl: PublicSuffixList instance or None for bundled list
+    """
+    global _DEFAULT_PSL
+    _DEFAULT_PSL = psl
+
+
+def _public_suffix_split(url, psl):
+    """ Host labels of URL and size of their public suffix
+    """
+    if psl is None:
+        psl = _DEFAULT_PSL
+        if psl is None:
+            psl = PublicSuffixList.from_file()
+            set_public_suffix_list(psl)
+
+    host = _url_host(url)
+    if not host:
+        return [], 0
+    labels = host.split('.')
+    # Rules are in UNICODE, so IDNA labels are matched decoded
+    lookup = labels
+    if 'xn--' in host:
+        lookup = [_decode_idna_label(label) for label in labels]
+    return labels, psl.suffix_size(lookup)
+
+
+def _url_host(url):
+    """ Lowercase host of URL or domain without user, port and last dot
+    """
+    host = _loose_netloc(url).rpartition('@')[2]
+    return host.split(':')[0].rstrip('.').lower()
+
+
+class DomainSet(object):
+    """ Set of domains answering "is host one of them or their subdomain".
+
+    Domains are kept as full hostnames in a plain set. A host is matched
+    by looking up the host itself and then every suffix left after
+    dropping its leading labels, so membership costs O(number of labels)
+    set lookups whatever the set size is. IDN domains are stored in IDNA
+    (punycode) form.
+    """
+
+    def __init__(self, domains=()):
+        self._domains = set()
+        self.update(domains)
+
+    def __len__(self):
+        return len(self._domains)
+
+    def __iter__(self):
+        return iter(self._domains)
+
+    def __contains__(self, url):
+        """ Exact membership of URL or domain host """
+        try:
+            return self._key(url) in self._domains
+        except ValueError:
+            return False
+
+    def __repr__(self):
+        return 'DomainSet(%d domains)' % len(self._domains)
+
+    @staticmethod
+    def _key(url):
+        """ Normalized host of URL or domain
+        """
+        host = _url_host(url)
+        if not host.isascii():
+            try:
+                host = host.encode('idna').decode('ascii')
+            except UnicodeError:
+                pass
+        return host
+
+    def add(self, domain):
+        """ Add domain, URL of domain or parse_domain_list item
+
+        :param domain: Domain or URL string
+        """
+        key = self._key(domain)
+        if not key:
+            raise ValueError('Not valid domain: %s' % _url_string(domain))
+        self._domains.add(key)
+
+    def update(self, domains):
+        """ Add many domains, e.g. parse_domain_list result
+
+        :param domains: Iterable of domains or URLs
+        """
+        for domain in domains:
+            self.add(domain)
+
+    def remove(self, domain):
+        """ Remove domain, raises KeyError if it is not in set
+
+        :param domain: Domain or URL string
+        """
+        self._domains.remove(self._key(domain))
+
+    def discard(self, domain):
+        """ Remove domain if it is in set
+
+        :param domain: Domain or URL string
+        """
+        self._domains.discard(self._key(domain))
+
+    def match(self, url):
+        """ Find domain of set which URL host equals or is subdomain of
+
+        :param url: URL or domain string
+        :returns: the most specific matching domain or None
+        """
+        try:
+            host = self._key(url)
+        except ValueError:
+            # urlparse rejects URLs like http://[x/
+            return None
+        domains = self._domains
+        while host:
+            if host in domains:
+                return host
+            host = host.partition('.')[2]
+        return None
+
+    def matches(self, url):
+        """ Check is URL host one of domains or their subdomain
+
+        :param url: URL or domain string
+        :returns: Boolean True or False
+        """
+        return self.match(url) is not None
+
+    def matches_many(self, urls):
+        """ Check many URLs, see matches
+
+        :param urls: Iterable of URLs or domains
+        :returns: list of booleans in the order of urls
+        """
+        match = self.match
+        return [match(url) is not None for url in urls]
+
+    def match_many(self, urls):
+        """ Find matching domains for many URLs, see match
+
+        :param urls: Iterable of URLs or domains
+        :returns: list of matching domains or None in the order of urls
+        """
+        match = self.match
+        return [match(url) for url in urls]
+
+
+def _decode_idna_label(label):
+    """ UNICODE form of IDNA (punycode) label
+    """
+    if not label.startswith('xn--'):
+        return label
+    try:
+        return label.encode('ascii').decode('idna')
+    except UnicodeError:
+        return label
+
+
+class URLTable(object):
+    """ Compact column store of many valid URLs.
+
+    Text of all URLs is kept UTF-8 encoded in one bytearray, URL
+    boundaries in an array('Q') and offsets of URL parts, relative to
+    URL start, in array('I') columns: end of scheme, start of path,
+    start of query and start of fragment. Netloc starts right after
+    '://' of the scheme. Netlocs are interned, every distinct one
+    is stored once and rows keep its number.
+
+    A URL costs its UTF-8 length plus 28 bytes, against about 500 bytes
+    of a str with its urllib.parse.urlparse result, see bench_urlfuncs3.py.
+    """
+
+    def __init__(self, urls=()):
+        self._buffer = bytearray()
+        self._offsets = array.array('Q', [0])
+        self._scheme_ends = array.array('I')
+        self._path_starts = array.array('I')
+        self._query_starts = array.array('I')
+        self._fragment_starts = array.array('I')
+        self._host_ids = array.array('I')
+        self.hosts = []
+        self._host_index = {}
+        self._zones = []
+        self.extend(urls)
+
+    @classmethod
+    def from_lines(cls, lines, on_error=None, rejects=None):
+        """ Table of URLs of text or file object, see iter_url_list
+
+        :param lines: Text, text or binary file object or iterable of lines
+        :param on_error: Callable on_error(line_no, line) for invalid lines
+        :param rejects: File-like object to write invalid lines to
+        :returns: URLTable instance
+        """
+        return cls(url for _, url in iter_url_list(lines, on_error, rejects))
+
+    def __len__(self):
+        return len(self._host_ids)
+
+    def __getitem__(self, index):
+        start, end = self._bounds(index)
+        return self._buffer[start:end].decode('utf-8', 'surrogatepass')
+
+    def __iter__(self):
+        buffer = self._buffer
+        offsets = self._offsets
+        for index in range(len(self)):
+            yield buffer[offsets[index]:offsets[index + 1]].decode(
+                'utf-8', 'surrogatepass')
+
+    def __repr__(self):
+        return 'URLTable(%d urls, %d hosts)' % (len(self), len(self.hosts))
+
+    def _bounds(self, index):
+        """ Buffer offsets of URL start and end
+        """
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('URLTable index out of range')
+        return self._offsets[index], self._offsets[index + 1]
+
+    def append(self, url):
+        """ Add URL, raises ValueError if it is not valid
+
+        :param url: URL string, see is_string_url
+        """
+        url = _url_string(url)
+        if isinstance(url, str):
+            text = url.encode('utf-8', 'surrogatepass')
+        else:
+            text = bytes(url)
+            url = decode_string(text)
+            text = url.encode('utf-8', 'surrogatepass')
+        if not is_string_url(url):
+            raise ValueError('Not valid URL: %s' % url)
+
+        # Same split as urllib.parse.urlsplit, on valid URL only
+        scheme_end = text.index(b':')
+        netloc_start = scheme_end + 3
+        path_start = len(text)
+        for delimiter in b'/?#':
+            position = text.find(delimiter, netloc_start, path_start)
+            if position >= 0:
+                path_start = position
+        fragment_start = text.find(b'#', path_start)
+        if fragment_start < 0:
+            fragment_start = len(text)
+        query_start = text.find(b'?', path_start, fragment_start)
+        if query_start < 0:
+            query_start = fragment_start
+
+        netloc = text[netloc_start:path_start].decode('utf-8', 'surrogatepass')
+        host_id = self._host_index.get(netloc)
+        if host_id is None:
+            host_id = self._host_index[netloc] = len(self.hosts)
+            self.hosts.append(netloc)
+            self._zones.append(None)
+
+        self._buffer += text
+        self._offsets.append(len(self._buffer))
+        self._scheme_ends.append(scheme_end)
+        self._path_starts.append(path_start)
+        self._query_starts.append(query_start)
+        self._fragment_starts.append(fragment_start)
+        self._host_ids.append(host_id)
+
+    def extend(self, urls):
+        """ Add many URLs, e.g. parse_url_list result
+
+        :param urls: Iterable of URL strings
+        """
+        for url in urls:
+            self.append(url)
+
+    def parts(self, index):
+        """ Parts of URL as urllib.parse.urlsplit would give them
+
+        :param index: Row number
+        :returns: (scheme, netloc, path, query, fragment) tuple
+        """
+        start, end = self._bounds(index)
+        if index < 0:
+            index += len(self)
+        text = self._buffer[start:end].decode('utf-8', 'surrogatepass')
+        # Offsets are in bytes, they match str ones for ASCII URLs only
+        if len(text) != end - start:
+            return urllib.parse.urlsplit(text)[:]
+        scheme_end = self._scheme_ends[index]
+        path_start = self._path_starts[index]
+        query_start = self._query_starts[index]
+        fragment_start = self._fragment_starts[index]
+        return (text[:scheme_end].lower(), self.hosts[self._host_ids[index]],
+                text[path_start:query_start],
+                text[query_start + 1:fragment_start],
+                text[fragment_start + 1:])
+
+    def get_url_domains(self):
+        """ get_url_domain of every URL, strings are shared between rows
+
+        :returns: list of netlocs
+        """
+        hosts = self.hosts
+        return [hosts[host_id] for host_id in self._host_ids]
+
+    def split_urls(self, clean_domain=True):
+        """ split_url of every URL, URI is the text after netloc
+
+        :param clean_domain: Bool flag to clean www in domain
+        :returns: list of (domain, uri) tuples
+        """
+        domains = self.hosts
+        if clean_domain:
+            domains = [remove_www(host) for host in domains]
+        buffer = self._buffer
+        offsets = self._offsets
+        path_starts = self._path_starts
+        return [(domains[host_id],
+                 buffer[offsets[index] + path_starts[index]:
+                        offsets[index + 1]].decode('utf-8', 'surrogatepass'))
+                for index, host_id in enumerate(self._host_ids)]
+
+    def get_domain_zones(self):
+        """ get_domain_zone of every URL, computed once per netloc
+
+        :returns: list of domain zones
+        """
+        zones = self._zones
+        for host_id, zone in enumerate(zones):
+            if zone is None:
+                netloc = self.hosts[host_id]
+                zones[host_id] = _memoize('get_domain_zone', netloc,
+                                          _netloc_zone, netloc)
+        return [zones[host_id] for host_id in self._host_ids]
+
+    def memory_usage(self):
+        """ Bytes taken by the table, interned netlocs included
+
+        :returns: int size in bytes
+        """
+        columns = (self._buffer, self._offsets, self._scheme_ends,
+                   self._path_starts, self._query_starts,
+                   self._fragment_starts, self._host_ids, self.hosts,
+                   self._host_index, self._zones)
+        return (sum(sys.getsizeof(column) for column in columns) +
+                sum(sys.getsizeof(host) for host in self.hosts))
+
+
 def parse_url_list(text):
     """ Parse urls from text. Raises Exception if any of rows is not an url.
 
     :param text: String text with urls in every line
     :returns: list of urls
     """
-    urls = [ url.strip() for url in text.splitlines() if url ]
-    for i, url in enumerate(urls):
-        if not is_string_url(url):
-            raise ValueError('Invalid URL %s on string %s' % (url.encode('utf-8'), i))
-            break
-    return urls
+    return [url for _, url in iter_url_list(text)]
+
 
 def parse_domain_list(text):
     """ Parse domains from list. Raises Exception if any of rows is not a domain.
@@ -399,21 +2221,1120 @@ def parse_domain_list(text):
     :param text: String list with domains in every line
     :returns: list of domains
     """
-    domains = [ domain.strip() for domain in text.splitlines() if domain ]
-    validDomains = []
-    for i, domain in enumerate(domains):
-
-        parsed_domain = urllib.parse.urlparse(domain)
-        if parsed_domain.netloc:
-            domain = parsed_domain.netloc
-        elif parsed_domain.path:
-            domain = parsed_domain.path.split('/')[0]
-        validDomains.append(domain)
-        
-        if not is_string_domain(domain):
-            raise ValueError('Invalid domain %s on string %s' % (domain.encode('utf-8'), i))
+    return [domain for _, domain in iter_domain_list(text)]
+
+
+def iter_url_list(lines, on_error=None, rejects=None):
+    """ Iterate over urls of text or file object, one line at a time.
+
+    Invalid lines are passed to on_error and/or written to rejects.
+    Without both of them ValueError is raised on the first invalid line.
+
+    :param lines: Text, text or binary file object or iterable of lines
+    :param on_error: Callable on_error(line_no, line) for invalid lines
+    :param rejects: File-like object to write invalid lines to
+    :returns: generator of (line_no, url) tuples, line_no starts from 1
+    """
+    for line_no, line in _iter_list_lines(lines):
+        url = line.strip()
+        if is_string_url(url):
+            yield line_no, url
+        else:
+            _reject_list_line('URL', line_no, url, on_error, rejects)
+
+
+def iter_domain_list(lines, on_error=None, rejects=None):
+    """ Iterate over domains of text or file object, one line at a time.
+
+    Lines may be URLs, their domain is taken. Invalid lines are handled
+    the same way as in iter_url_list.
+
+    :param lines: Text, text or binary file object or iterable of lines
+    :param on_error: Callable on_error(line_no, line) for invalid lines
+    :param rejects: File-like object to write invalid lines to
+    :returns: generator of (line_no, domain) tuples, line_no starts from 1
+    """
+    for line_no, line in _iter_list_lines(lines):
+        domain = line.strip()
+        try:
+            domain = parse_url(domain).loose_netloc or domain
+        except ValueError:
+            # urlparse rejects lines like http://[bad/
+            domain = None
+        if domain is not None and is_string_domain(domain):
+            yield line_no, domain
+        else:
+            _reject_list_line('domain', line_no, line, on_error, rejects)
+
+
+def _iter_list_lines(lines, start=1, source=None):
+    """ Numbered non-empty decoded lines without line endings, source
+    is _SOURCE_ENCODINGS key of lines split to several batches
+    """
+    if isinstance(lines, (str, bytes)):
+        lines = lines.splitlines()
+    # Encoding detected for lines is kept here, not in _SOURCE_ENCODINGS
+    # which would keep the file object alive
+    encoding = None
+    for line_no, line in enumerate(lines, start):
+        if source is not None:
+            line = decode_string(line, source=source)
+        elif not isinstance(line, str):
+            line, detected = _decode_bytes(line, encoding)
+            if detected is not None:
+                encoding = detected
+        line = line.rstrip('\r\n')
+        if line:
+            yield line_no, line
+
+
+def _reject_list_line(kind, line_no, line, on_error, rejects):
+    """ Pass invalid list line to handlers or raise ValueError
+    """
+    if on_error is None and rejects is None:
+        raise ValueError('Invalid %s %s on string %s' % (
+            kind, line.encode('utf-8'), line_no))
+    if on_error is not None:
+        on_error(line_no, line)
+    if rejects is not None:
+        rejects.write(line + '\n')
+
+
+def iter_log_urls(path, start=0, end=None, validate=True):
+    """ Iterate over URLs found in a memory-mapped log file.
+
+    URL is a run of non-blank chars up to a quote or angle bracket,
+    after http(s):// or ftp(s)://, e.g. a referer of an access log.
+
+    :param path: Log file path
+    :param start: Offset to start scanning at, see split_log_file
+    :param end: Offset to stop scanning at, end of file by default.
+        Nothing after it is read, so it should be just after a line break
+    :param validate: Skip URLs failing is_string_url
+    :returns: generator of (offset, url) tuples
+    """
+    for offset, url in _iter_log_matches(path, start, end):
+        if not validate or _is_url_valid(url):
+            yield offset, url
+
+
+def iter_log_domains(path, start=0, end=None, validate=True):
+    """ Iterate over domains of URLs found in a memory-mapped log file
+
+    :param path: Log file path
+    :param start: Offset to start scanning at, see split_log_file
+    :param end: Offset to stop scanning at, end of file by default
+    :param validate: Skip URLs failing is_string_url, URLs urlparse
+        fails on are skipped anyway
+    :returns: generator of domains, see get_url_domain
+    """
+    host = get_url_domain if validate else _loose_netloc
+    for _, url in _iter_log_matches(path, start, end):
+        try:
+            domain = host(url)
+        except ValueError:
+            # Invalid URL, or one urlparse fails on like http://[bad/
+            continue
+        yield domain
+
+
+def split_log_file(path, parts):
+    """ Split file to ranges of whole lines for parallel scanning, e.g.
+    by iter_log_urls(path, start, end) in a process per range
+
+    :param path: Log file path
+    :param parts: Number of ranges wanted
+    :returns: list of at most parts (start, end) tuples covering the file
+    """
+    if parts < 1:
+        raise ValueError('Number of parts must be positive')
+    size = os.path.getsize(path)
+    if not size:
+        return []
+    ranges = []
+    start = 0
+    with open(path, 'rb') as log_file:
+        mapped = mmap.mmap(log_file.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        for part in range(1, parts + 1):
+            end = size * part // parts
+            if end <= start:
+                continue
+            # Range ends after the newline of its last line
+            newline = mapped.find(b'\n', end - 1)
+            end = size if newline < 0 or part == parts else newline + 1
+            ranges.append((start, end))
+            start = end
+            if start >= size:
+                break
+    finally:
+        mapped.close()
+    return ranges
+
+
+def _iter_log_matches(path, start, end):
+    """ (offset, url) of every URL-like range of file, not validated
+    """
+    if not os.path.getsize(path):
+        return
+    with open(path, 'rb') as log_file:
+        mapped = mmap.mmap(log_file.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        if end is None:
+            end = len(mapped)
+        # '://' is found by fast literal search, scheme is checked behind it.
+        # URL can not cross line break range ends on, see split_log_file
+        for match in _LOG_URL_TAIL_REGEX.finditer(mapped, start, end):
+            position = match.start()
+            scheme = _LOG_URL_SCHEME_REGEX.search(
+                mapped, max(0, position - 6), position)
+            if scheme is None:
+                continue
+            offset = scheme.start(1)
+            if offset < start:
+                # Belongs to the previous range
+                continue
+            yield offset, _bytes_string(mapped[offset:match.end()])
+    finally:
+        mapped.close()
+
+
+def _is_url_valid(url):
+    """ is_string_url of str, ASCII URLs are checked without decoding
+    """
+    if url.isascii():
+        return _memoize('is_string_url', url, _is_ascii_url_valid, url)
+    return is_string_url(url)
+
+
+def find_urls(text):
+    """ Find all URLs in free text, e.g. email, HTML text or chat log
+
+    :param text: str or bytes text
+    :returns: list of URLs, see iter_urls
+    """
+    return [url for _, url in iter_urls(text)]
+
+
+def iter_urls(text):
+    """ Iterate over URLs in free text.
+
+    Text is searched for '://' and 'www.' only, every hit is extended
+    to a run of non-blank chars, trimmed of trailing punctuation and
+    unbalanced closing brackets, and checked by is_string_url.
+    URLs starting with www. are yielded as written, without protocol.
+    URLs longer than MAX_TEXT_URL_LENGTH are skipped.
+
+    :param text: str or bytes text
+    :returns: generator of (offset, url) tuples
+    """
+    text = decode_string(text)
+    position = 0
+    # End of the run of URL chars found last, markers inside the run share it
+    run_end = 0
+    while True:
+        match = _TEXT_URL_MARKER_REGEX.search(text, position)
+        if match is None:
+            return
+        marker = match.start()
+        www = match.group() != '://'
+        if not www:
+            scheme = _TEXT_URL_SCHEME_REGEX.search(
+                text, max(0, marker - 6), marker)
+            start = None if scheme is None else scheme.start(1)
+            tail = marker + 3
+        else:
+            previous = text[marker - 1:marker]
+            start = None if previous and (previous.isalnum() or
+                                          previous in '.-_@/') else marker
+            tail = marker
+        if start is not None and tail >= run_end:
+            run_end = _TEXT_URL_TAIL_REGEX.match(text, tail).end()
+        if start is None or run_end - start > MAX_TEXT_URL_LENGTH:
+            position = match.end()
+            continue
+        url = _trim_url(text[start:run_end])
+        if url and _is_url_valid('http://' + url if www else url):
+            yield start, url
+            position = start + len(url)
+        else:
+            position = match.end()
+
+
+def _trim_url(url):
+    """ URL without trailing punctuation and unbalanced closing brackets
+    """
+    while url:
+        last = url[-1]
+        if last in _TRAILING_PUNCTUATION:
+            url = url[:-1]
+        elif (last in _CLOSING_BRACKETS and
+              url.count(_CLOSING_BRACKETS[last]) < url.count(last)):
+            url = url[:-1]
+        else:
             break
-    return validDomains
+    return url
+
+
+class HostAnalytics(object):
+    """ Hosts, domain zones and root domain zones of a column of URLs.
+
+    Host is the netloc get_domain_zone and get_root_domain_zone take
+    zones of. With NumPy installed, hosts of NumPy string arrays are cut
+    by vectorized string operations, and Python code runs once per
+    distinct host, not per row. URLTable hosts are interned already.
+    Other input, or any input without NumPy, is handled row by row.
+
+    Per row results are NumPy arrays with NumPy, lists without it.
+    Hosts which can not be parsed, e.g. broken IPv6, are empty.
+    """
+
+    def __init__(self, urls):
+        numpy = _get_numpy()
+        if isinstance(urls, URLTable):
+            self.distinct_hosts = list(urls.hosts)
+            host_ids = urls._host_ids
+            if numpy is not None:
+                host_ids = numpy.frombuffer(host_ids, dtype=numpy.uint32)
+        elif (numpy is not None and isinstance(urls, numpy.ndarray) and
+              urls.dtype.kind in 'OUST'):
+            host_ids = self._vectorized_host_ids(numpy, urls)
+        else:
+            host_ids = self._host_ids_of(urls)
+            if numpy is not None:
+                host_ids = numpy.array(host_ids, dtype=numpy.uint32)
+        self.host_ids = host_ids
+        self._zones = None
+        self._root_zones = None
+
+    def __len__(self):
+        return len(self.host_ids)
+
+    def _host_ids_of(self, urls):
+        """ Row host numbers, hosts are found row by row
+        """
+        index = {}
+        self.distinct_hosts = []
+        host_ids = []
+        for url in urls:
+            if isinstance(url, _BYTES_TYPES):
+                url = _bytes_string(url)
+            host = _analytics_host(url)
+            host_id = index.get(host)
+            if host_id is None:
+                host_id = index[host] = len(self.distinct_hosts)
+                self.distinct_hosts.append(host)
+            host_ids.append(host_id)
+        return host_ids
+
+    def _vectorized_host_ids(self, numpy, urls):
+        """ Row host numbers, URLs are cut after netloc in vectorized way
+        and hosts are found once per distinct cut
+        """
+        strings = numpy.strings
+        if urls.dtype.kind == 'S':
+            urls = strings.decode(urls, 'utf-8', 'surrogateescape')
+        elif urls.dtype.kind == 'O':
+            urls = urls.astype(str)
+        urls = urls.ravel()
+        length = strings.str_len(urls)
+
+        def first_delimiter(start):
+            positions = [strings.find(urls, char, start) for char in '/?#']
+            positions = [numpy.where(found < 0, length, found)
+                         for found in positions]
+            return numpy.minimum.reduce(positions)
+
+        # Netloc ends at the first /?# after //, if // goes first,
+        # else there is no netloc and the first path part ends there
+        first = first_delimiter(0)
+        slashes = strings.find(urls, '//')
+        after_slashes = first_delimiter(numpy.maximum(slashes + 2, 0))
+        end = numpy.where(slashes == first, after_slashes, first)
+        # urlparse removes tabs and line breaks and leading blanks,
+        # such URLs are taken whole
+        unusual = strings.slice(urls, 0, 1) <= ' '
+        for char in '\t\n\r':
+            unusual |= strings.find(urls, char) >= 0
+        # Delimiter stays, so urlparse sees the same last path part
+        end = numpy.where(unusual, length, numpy.minimum(end + 1, length))
+        heads = strings.slice(urls, 0, end)
+
+        distinct_heads, head_ids = numpy.unique(heads, return_inverse=True)
+        head_host_ids = self._host_ids_of(distinct_heads.tolist())
+        return numpy.array(head_host_ids, dtype=numpy.uint32)[
+            head_ids.ravel()]
+
+    def _distinct_values(self, values):
+        """ Per row array or list of values of distinct hosts
+        """
+        numpy = _get_numpy()
+        if numpy is None:
+            return [values[host_id] for host_id in self.host_ids]
+        return numpy.array(values)[self.host_ids]
+
+    def hosts(self):
+        """ Host of every row
+
+        :returns: array or list of hosts
+        """
+        return self._distinct_values(self.distinct_hosts)
+
+    def zones(self):
+        """ get_domain_zone of every row, computed once per host
+
+        :returns: array or list of domain zones
+        """
+        return self._distinct_values(self._distinct_zones())
+
+    def root_zones(self):
+        """ get_root_domain_zone of every row, computed once per host
+
+        :returns: array or list of root domain zones
+        """
+        return self._distinct_values(self._distinct_root_zones())
+
+    def counts(self, by='host'):
+        """ Number of rows by host, zone or root zone
+
+        :param by: 'host', 'zone' or 'root_zone'
+        :returns: dict of counts, most common values first
+        """
+        if by == 'host':
+            values = self.distinct_hosts
+        elif by == 'zone':
+            values = self._distinct_zones()
+        elif by == 'root_zone':
+            values = self._distinct_root_zones()
+        else:
+            raise ValueError('Unknown grouping: %s' % by)
+        numpy = _get_numpy()
+        if numpy is None:
+            host_counts = collections.Counter(self.host_ids)
+            host_counts = [host_counts[host_id]
+                           for host_id in range(len(values))]
+        else:
+            host_counts = numpy.bincount(
+                self.host_ids, minlength=len(values)).tolist()
+        counts = collections.Counter()
+        for value, count in zip(values, host_counts):
+            if count:
+                counts[value] += count
+        return dict(counts.most_common())
+
+    def _distinct_zones(self):
+        if self._zones is None:
+            self._zones = [_memoize('get_domain_zone', host, _netloc_zone,
+                                    host)
+                           for host in self.distinct_hosts]
+        return self._zones
+
+    def _distinct_root_zones(self):
+        if self._root_zones is None:
+            self._root_zones = [host.split('.')[-1]
+                                for host in self.distinct_hosts]
+        return self._root_zones
+
+
+def _analytics_host(url):
+    """ Loose netloc of URL, empty for URLs urlparse fails on
+    """
+    try:
+        return _loose_netloc(url)
+    except ValueError:
+        return ''
+
+
+def _get_numpy():
+    """ Import NumPy on first use, it is optional
+
+    :returns: numpy module or None if it is not installed or older than 2.3
+    """
+    global _NUMPY
+    if _NUMPY is _UNSET:
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        if not hasattr(getattr(numpy, 'strings', None), 'slice'):
+            numpy = None
+        _NUMPY = numpy
+    return _NUMPY
+
+
+def validate_many(urls, workers=None, chunksize=None):
+    """ is_string_url for every URL, computed by a pool of processes
+
+    :param urls: Iterable of URL strings
+    :param workers: Number of processes, os.cpu_count() by default
+    :param chunksize: URLs per batch sent to a process, auto by default
+    :returns: generator of booleans in the order of urls
+    """
+    return _map_many(_validate_batch, urls, workers, chunksize)
+
+
+def clean_many(urls, workers=None, chunksize=None):
+    """ full_clean_url for every URL, computed by a pool of processes
+
+    :param urls: Iterable of URL strings
+    :param workers: Number of processes, os.cpu_count() by default
+    :param chunksize: URLs per batch sent to a process, auto by default
+    :returns: generator of cleaned URLs in the order of urls
+    """
+    return _map_many(_clean_batch, urls, workers, chunksize)
+
+
+def _validate_batch(urls):
+    """ Worker side of validate_many
+    """
+    return [is_string_url(url) for url in urls]
+
+
+def _clean_batch(urls):
+    """ Worker side of clean_many
+    """
+    return [full_clean_url(url) for url in urls]
+
+
+def _bulk_chunksize(urls, workers):
+    """ Batch size giving every worker a few batches of sized input
+    """
+    try:
+        size = len(urls) // (workers * 4)
+    except TypeError:
+        return MAX_BULK_CHUNKSIZE // 4
+    return max(MIN_BULK_CHUNKSIZE, min(MAX_BULK_CHUNKSIZE, size))
+
+
+def _map_many(func, items, workers, chunksize):
+    """ Ordered map of batch function over items in a process pool
+
+    Only a couple of batches per worker are in flight at once,
+    so input of any length is handled in bounded memory.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers < 1:
+        raise ValueError('Number of workers must be positive')
+    if chunksize is None:
+        chunksize = _bulk_chunksize(items, workers)
+
+    iterator = iter(items)
+    batches = iter(lambda: list(itertools.islice(iterator, chunksize)), [])
+    if workers == 1:
+        for batch in batches:
+            yield from func(batch)
+        return
+
+    import concurrent.futures
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        pending = collections.deque()
+        for batch in batches:
+            pending.append(executor.submit(func, batch))
+            if len(pending) >= workers * 2:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+async def aiter_url_list(lines, on_error=None, rejects=None, executor=None,
+                         chunksize=ASYNC_CHUNKSIZE,
+                         max_pending=ASYNC_MAX_PENDING):
+    """ Async iter_url_list, checking batches of lines in executor
+
+    At most max_pending batches are in executor at once, the next lines
+    are not read from input until the oldest batch is consumed. Threads
+    of default executor still compete with the loop for the GIL,
+    ProcessPoolExecutor keeps loop latency lowest.
+
+    :param lines: Async iterable or iterable of text or binary lines
+    :param on_error: Callable on_error(line_no, line) for invalid lines
+    :param rejects: File-like object to write invalid lines to
+    :param executor: concurrent.futures executor, default of loop if None
+    :param chunksize: Lines per batch
+    :param max_pending: Max number of batches in executor
+    :returns: async generator of (line_no, url) tuples
+    """
+    if isinstance(lines, (str, bytes)):
+        lines = lines.splitlines()
+    source = ('stream', next(_STREAM_IDS))
+    batches = _anumbered_batches(lines, chunksize, source)
+    async for results in _amap_batches(_url_list_batch, batches, executor,
+                                       max_pending):
+        for line_no, url, is_valid in results:
+            if is_valid:
+                yield line_no, url
+            else:
+                _reject_list_line('URL', line_no, url, on_error, rejects)
+
+
+async def avalidate_many(urls, executor=None, chunksize=ASYNC_CHUNKSIZE,
+                         max_pending=ASYNC_MAX_PENDING):
+    """ Async validate_many, checking batches of URLs in executor
+
+    :param urls: Async iterable or iterable of URL strings
+    :param executor: concurrent.futures executor, default of loop if None
+    :param chunksize: URLs per batch
+    :param max_pending: Max number of batches in executor
+    :returns: async generator of booleans in the order of urls
+    """
+    async for results in _amap_batches(
+            _validate_batch, _abatches(urls, chunksize), executor,
+            max_pending):
+        for result in results:
+            yield result
+
+
+async def aclean_many(urls, executor=None, chunksize=ASYNC_CHUNKSIZE,
+                      max_pending=ASYNC_MAX_PENDING):
+    """ Async clean_many, cleaning batches of URLs in executor
+
+    :param urls: Async iterable or iterable of URL strings
+    :param executor: concurrent.futures executor, default of loop if None
+    :param chunksize: URLs per batch
+    :param max_pending: Max number of batches in executor
+    :returns: async generator of cleaned URLs in the order of urls
+    """
+    async for results in _amap_batches(
+            _clean_batch, _abatches(urls, chunksize), executor, max_pending):
+        for result in results:
+            yield result
+
+
+def _url_list_batch(batch):
+    """ Executor side of aiter_url_list
+    """
+    first_line_no, lines, source = batch
+    results = []
+    for line_no, line in _iter_list_lines(lines, first_line_no, source):
+        url = line.strip()
+        results.append((line_no, url, is_string_url(url)))
+    return results
+
+
+async def _abatches(items, chunksize):
+    """ Lists of chunksize items of async iterable or iterable
+    """
+    if chunksize < 1:
+        raise ValueError('chunksize must be positive')
+    batch = []
+    if hasattr(items, '__aiter__'):
+        async for item in items:
+            batch.append(item)
+            if len(batch) >= chunksize:
+                yield batch
+                batch = []
+    else:
+        for item in items:
+            batch.append(item)
+            if len(batch) >= chunksize:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+async def _anumbered_batches(lines, chunksize, source):
+    """ Batches of lines with number of the first line and encoding source
+    """
+    line_no = 1
+    async for batch in _abatches(lines, chunksize):
+        yield line_no, batch, source
+        line_no += len(batch)
+
+
+async def _amap_batches(func, batches, executor, max_pending):
+    """ Ordered map of batch function in executor with bounded queue
+    """
+    if max_pending < 1:
+        raise ValueError('max_pending must be positive')
+    import asyncio
+    loop = asyncio.get_running_loop()
+    pending = collections.deque()
+    try:
+        async for batch in batches:
+            pending.append(loop.run_in_executor(executor, func, batch))
+            if len(pending) >= max_pending:
+                yield await pending.popleft()
+        while pending:
+            yield await pending.popleft()
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def canonical_url_key(url):
+    """ Key equal for http/https, www/non-www and trailing slash variants
+
+    :param url: Something like URL
+    :returns: Canonical key string, see full_clean_url
+    """
+    return full_clean_url(url)
+
+
+def url_variants(url):
+    """ http/https, www/non-www and trailing slash variants of URL
+
+    Variants are built from canonical_url_key of URL, so each of them
+    has that key too unless the key itself starts with www.
+
+    :param url: Something like URL
+    :returns: list of 8 URL strings
+    """
+    url_key = canonical_url_key(url)
+    return ['%s://%s%s%s' % (scheme, www, url_key, slash)
+            for scheme in _HTTP_SCHEMES
+            for www in ('', 'www.')
+            for slash in ('', '/')]
+
+
+class URLIndex(object):
+    """ URLs grouped by variant-insensitive key, for matching URL lists.
+
+    Every URL is stored once under its key, canonical_url_key by default,
+    so http/https, www/non-www and trailing slash variants share a key
+    and lookup of any of them returns every stored variant. Matching two
+    URL lists is a hash join: one key and one dict lookup per URL instead
+    of building and looking up all url_variants of it.
+
+    A key with one URL keeps the URL string itself, a list is made only
+    for keys with several variants.
+    """
+
+    def __init__(self, urls=(), key=canonical_url_key):
+        self.key = key
+        self._variants = {}
+        self._count = 0
+        self.add_many(urls)
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        for variants in self._variants.values():
+            if isinstance(variants, list):
+                yield from variants
+            else:
+                yield variants
+
+    def __contains__(self, url):
+        """ Is any variant of URL in index """
+        return self._key_function()(url) in self._variants
+
+    def __repr__(self):
+        return 'URLIndex(%d URLs, %d keys)' % (
+            self._count, len(self._variants))
+
+    def _key_function(self):
+        """ key, canonical_url_key goes straight to its normalizer
+        """
+        if self.key is canonical_url_key:
+            return _FULL_CLEAN_NORMALIZER.normalize
+        return self.key
+
+    def add(self, url):
+        """ Add URL
+
+        :param url: URL string or ParsedURL
+        :returns: True if URL was not in index before
+        """
+        return self.add_many((url,)) == 1
+
+    def add_many(self, urls):
+        """ Add many URLs
+
+        :param urls: Iterable of URL strings or ParsedURL
+        :returns: number of URLs which were not in index before
+        """
+        key = self._key_function()
+        index = self._variants
+        added = 0
+        for url in urls:
+            url = _url_string(url)
+            url_key = key(url)
+            variants = index.get(url_key)
+            if variants is None:
+                index[url_key] = url
+            elif isinstance(variants, list):
+                if url in variants:
+                    continue
+                variants.append(url)
+            elif variants == url:
+                continue
+            else:
+                index[url_key] = [variants, url]
+            added += 1
+        self._count += added
+        return added
+
+    def lookup(self, url):
+        """ Stored variants of URL
+
+        :param url: URL string or ParsedURL
+        :returns: list of stored URLs in the order they were added
+        """
+        return self.lookup_many((url,))[0]
+
+    def lookup_many(self, urls):
+        """ Stored variants of many URLs, see lookup
+
+        :param urls: Iterable of URL strings or ParsedURL
+        :returns: list of lists of stored URLs in the order of urls
+        """
+        key = self._key_function()
+        get = self._variants.get
+        found = []
+        for url in urls:
+            variants = get(key(url))
+            if variants is None:
+                found.append([])
+            elif isinstance(variants, list):
+                found.append(list(variants))
+            else:
+                found.append([variants])
+        return found
+
+
+class BloomFilter(object):
+    """ Compact "seen URL" set over a bytearray of bits.
+
+    Answers "was this URL added" with no false negatives and about
+    error_rate false positives while at most capacity keys are added.
+    Keys are passed through key function, canonical_url_key by default,
+    so http/https, www and trailing slash variants are the same key.
+
+    Memory is -ln(error_rate) / ln(2)^2 bits per entry: 1.2 bytes at 0.01,
+    1.8 bytes at 0.001, 3.6 bytes at 0.000001, against about 110 bytes
+    of a set of canonical URL strings. Measured by bench_urlfuncs3.py
+    on one core with error_rate 0.001: add_many about 110K URLs/s,
+    contains_many about 150K URLs/s, a third of it in canonical_url_key.
+
+    Filter saved by save() can be memory-mapped by load() in several
+    processes at once, read-only.
+    """
+
+    def __init__(self, capacity, error_rate=0.001, key=canonical_url_key,
+                 bits=None, hashes=None, count=0, mapped=None):
+        if capacity < 1 or not 0 < error_rate < 1:
+            raise ValueError('Capacity must be positive, error rate in (0, 1)')
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.key = key
+        if bits is None:
+            size = -capacity * math.log(error_rate) / (math.log(2) ** 2)
+            bits = bytearray(max(1, int(math.ceil(size / 8.0))))
+        self.bits = bits
+        self.size = len(bits) * 8
+        if hashes is None:
+            hashes = int(round(self.size / float(capacity) * math.log(2)))
+        self.hashes = max(1, hashes)
+        self.count = count
+        self._mapped = mapped
+        import hashlib
+        self._blake2b = hashlib.blake2b
+        # Hash values are slices of one digest while it is long enough
+        width = 4 if self.size <= 1 << 32 else 8
+        self._digest_size = self.hashes * width
+        if self._digest_size <= 64:
+            self._unpack = struct.Struct(
+                '<%d%s' % (self.hashes, 'I' if width == 4 else 'Q')).unpack
+        else:
+            self._unpack = None
+
+    def __len__(self):
+        return self.count
+
+    def _positions(self, key):
+        """ Hash values of key, bit positions modulo size
+        """
+        if self.key is not None:
+            key = self.key(key)
+        if isinstance(key, str):
+            key = key.encode('utf-8')
+        if self._unpack is not None:
+            return self._unpack(self._blake2b(
+                key, digest_size=self._digest_size).digest())
+        # Double hashing for more hashes than one digest holds
+        digest = self._blake2b(key, digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return [first + i * second for i in range(self.hashes)]
+
+    def add(self, key):
+        """ Add key
+
+        :param key: URL, str or bytes key
+        :returns: True if key was not in filter before
+        """
+        if self._mapped is not None:
+            raise TypeError('Memory-mapped BloomFilter is read-only')
+        bits = self.bits
+        size = self.size
+        added = False
+        for position in self._positions(key):
+            position %= size
+            mask = 1 << (position & 7)
+            byte = bits[position >> 3]
+            if not byte & mask:
+                bits[position >> 3] = byte | mask
+                added = True
+        if added:
+            self.count += 1
+        return added
+
+    def add_many(self, keys):
+        """ Add several keys
+
+        :param keys: Iterable of keys
+        :returns: list of add() results
+        """
+        if self._mapped is not None:
+            raise TypeError('Memory-mapped BloomFilter is read-only')
+        bits = self.bits
+        size = self.size
+        positions = self._positions
+        result = []
+        append = result.append
+        count = 0
+        for key in keys:
+            added = False
+            for position in positions(key):
+                position %= size
+                mask = 1 << (position & 7)
+                byte = bits[position >> 3]
+                if not byte & mask:
+                    bits[position >> 3] = byte | mask
+                    added = True
+            count += added
+            append(added)
+        self.count += count
+        return result
+
+    def __contains__(self, key):
+        bits = self.bits
+        size = self.size
+        for position in self._positions(key):
+            position %= size
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def contains_many(self, keys):
+        """ Check several keys
+
+        :param keys: Iterable of keys
+        :returns: list of booleans, True for probably added keys
+        """
+        bits = self.bits
+        size = self.size
+        positions = self._positions
+        result = []
+        append = result.append
+        for key in keys:
+            for position in positions(key):
+                position %= size
+                if not bits[position >> 3] & (1 << (position & 7)):
+                    append(False)
+                    break
+            else:
+                append(True)
+        return result
+
+    @classmethod
+    def load(cls, path, key=canonical_url_key):
+        """ Memory-map filter written by save(), read-only
+
+        :param path: Filter file path
+        :param key: Key function, the same the filter was built with
+        :returns: BloomFilter instance or raises ValueError
+        """
+        error = 'Not a saved BloomFilter: %s' % path
+        mapped, (capacity, error_rate, hashes, count, size) = (
+            _map_saved_file(path, _BLOOM_HEADER, _BLOOM_MAGIC, error))
+        header_size = struct.calcsize(_BLOOM_HEADER)
+        if len(mapped) != header_size + size:
+            mapped.close()
+            raise ValueError(error)
+        bits = memoryview(mapped)[header_size:]
+        return cls(capacity, error_rate, key, bits, hashes, count, mapped)
+
+    def save(self, path):
+        """ Write filter to file for load()
+
+        :param path: Filter file path
+        """
+        with open(path, 'wb') as bloom_file:
+            bloom_file.write(struct.pack(
+                _BLOOM_HEADER, _BLOOM_MAGIC, self.capacity, self.error_rate,
+                self.hashes, self.count, len(self.bits)))
+            bloom_file.write(self.bits)
+
+    def close(self):
+        """ Release memory-mapped file of filter loaded by load()
+        """
+        if self._mapped is not None:
+            self.bits.release()
+            self.bits = None
+            self._mapped.close()
+            self._mapped = None
+
+
+def dedupe_urls(urls, **kwargs):
+    """ Iterate over URLs skipping variants of already seen ones
+
+    :param urls: Iterable of URL strings
+    :param kwargs: URLDeduplicator options
+    :returns: generator of unique URLs, see URLDeduplicator.dedupe
+    """
+    return URLDeduplicator(**kwargs).dedupe(urls)
+
+
+class URLDeduplicator(object):
+    """ Streaming deduplication of URLs by canonical_url_key in bounded memory.
+
+    DEDUP_EXACT mode keeps at most max_items keys in memory. When there
+    are more unique keys, they are spilled to sorted run files, merged
+    when the input is over. DEDUP_BLOOM mode keeps a BloomFilter and may
+    drop about error_rate of unique URLs as false duplicates.
+    """
+
+    def __init__(self, mode=DEDUP_EXACT, max_items=1000000, capacity=None,
+                 error_rate=0.001, tmpdir=None, key=canonical_url_key):
+        if mode not in (DEDUP_EXACT, DEDUP_BLOOM):
+            raise ValueError('Unknown deduplication mode: %s' % mode)
+        if max_items < 1:
+            raise ValueError('max_items must be positive')
+        self.mode = mode
+        self.max_items = max_items
+        self.capacity = capacity or max_items
+        self.error_rate = error_rate
+        self.tmpdir = tmpdir
+        self.key = key
+        self.seen = 0
+        self.unique = 0
+        self.runs = 0
+        self.peak_memory = 0
+
+    def stats(self):
+        """ Deduplication counters
+
+        :returns: dict with seen, unique and duplicate URL counts,
+            number of spilled runs and peak memory of keys in bytes
+        """
+        return {
+            'seen': self.seen,
+            'unique': self.unique,
+            'duplicates': self.seen - self.unique,
+            'runs': self.runs,
+            'peak_memory': self.peak_memory,
+        }
+
+    def dedupe(self, urls):
+        """ Iterate over first occurrences of every canonical key
+
+        Bloom mode and exact mode within max_items keys yield URLs as soon
+        as they are read, in the input order. URLs read after exact mode
+        spilled to disk are yielded when the input is over, in key order.
+
+        :param urls: Iterable of URL strings
+        :returns: generator of unique URLs
+        """
+        if self.mode == DEDUP_BLOOM:
+            return self._dedupe_bloom(urls)
+        return self._dedupe_exact(urls)
+
+    def _dedupe_bloom(self, urls):
+        seen = BloomFilter(self.capacity, self.error_rate, key=None)
+        self.peak_memory = sys.getsizeof(seen.bits)
+        key = self.key
+        for url in urls:
+            self.seen += 1
+            if seen.add(key(url)):
+                self.unique += 1
+                yield url
+
+    def _dedupe_exact(self, urls):
+        import shutil
+        import tempfile
+        key = self.key
+        urls = iter(urls)
+        seen = set()
+        memory = sys.getsizeof(seen)
+        # Online phase, every new key is yielded at once
+        for url in urls:
+            self.seen += 1
+            url_key = key(url)
+            if url_key in seen:
+                continue
+            seen.add(url_key)
+            memory += sys.getsizeof(url_key)
+            self._track_memory(memory + sys.getsizeof(seen))
+            self.unique += 1
+            yield url
+            if len(seen) >= self.max_items:
+                break
+        else:
+            return
+
+        # Keys seen so far make the first run, marked as already yielded
+        tmpdir = tempfile.mkdtemp(prefix='urlfuncs3-dedupe-', dir=self.tmpdir)
+        try:
+            runs = [self._write_run(
+                tmpdir, ((url_key, -1, None) for url_key in seen))]
+            seen = None
+            pending = {}
+            memory = sys.getsizeof(pending)
+            for number, url in enumerate(urls):
+                self.seen += 1
+                url_key = key(url)
+                if url_key not in pending:
+                    pending[url_key] = (number, url)
+                    memory += sys.getsizeof(url_key) + sys.getsizeof(url)
+                    self._track_memory(memory + sys.getsizeof(pending))
+                    if len(pending) >= self.max_items:
+                        runs.append(self._write_run(tmpdir, (
+                            (k, n, u) for k, (n, u) in pending.items())))
+                        pending = {}
+                        memory = sys.getsizeof(pending)
+            runs.append(self._write_run(tmpdir, (
+                (k, n, u) for k, (n, u) in pending.items())))
+            pending = None
+
+            # Merge runs, first record of every key decides
+            merged = heapq.merge(*[self._read_run(path) for path in runs])
+            last_key = None
+            for url_key, number, url in merged:
+                if url_key == last_key:
+                    continue
+                last_key = url_key
+                if number >= 0:
+                    self.unique += 1
+                    yield url
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+    def _track_memory(self, memory):
+        if memory > self.peak_memory:
+            self.peak_memory = memory
+
+    def _write_run(self, tmpdir, records):
+        """ Write records sorted by (key, number) to a new run file
+        """
+        import json
+        self.runs += 1
+        path = os.path.join(tmpdir, 'run%d' % self.runs)
+        with open(path, 'w', encoding='utf-8') as run_file:
+            for record in sorted(records, key=lambda record: record[:2]):
+                run_file.write(json.dumps(record))
+                run_file.write('\n')
+        return path
+
+    @staticmethod
+    def _read_run(path):
+        import json
+        with open(path, encoding='utf-8') as run_file:
+            for line in run_file:
+                yield tuple(json.loads(line))
 
 
 if __name__ == "__main__":